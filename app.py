@@ -3,37 +3,34 @@
 import pandas as pd
 from dash import Dash, dcc, html, callback_context, dash_table
 import pandas as pd
-import numpy as np
 import plotly.express as px
-import urllib
+import json
+import os
+import urllib.parse
 from dash.dependencies import Output, Input, State
+from flask import Response, abort, request, stream_with_context
 
 from constants import (
     INSPECTION_DETAILS_FOLDER_NAME,
     MAPPING_FILES_FOLDER_NAME,
     ALL,
-    STATE_NAMES,
-    TWO_DIGIT_NAICS,
 )
-from helpers import get_naics_sector_numbers_by_names
+from data_export import EXPORT_FORMATS, iter_export
+from ita_dataset import ItaDatasetHolder
+from ita_metadata import get_ita_metadata
+from rollup_cube import CUBE_DIMENSIONS, INTEGER_CUBE_DIMENSIONS
+from scatter_chart import build_scatter_chart
+from table_query import TABLE_PAGE_SIZE, get_table_page
 from scrapping_inspection_details import (
     parse_inspection_file,
     Inspection,
     get_inspection_details_list,
 )
 
-FILE_NAMES_ENCODING = {
-    #     'ITA Data CY 2016.zip': 'cp1252',
-    #     'ITA Data CY 2017.zip': 'cp1252',
-    #     'ITA Data CY 2018.zip': 'cp1252',
-    #     'ITA Data CY 2019.zip': 'utf-8',
-    "ITA Data CY 2020.zip": "utf-8",
-    "ITA Data CY 2021 submitted thru 8-29-2022.zip": "utf-8",
-}
 OWNERSHIP_MAP = {
-    "Not a government entity": 1.0,
-    "State Government entity": 2.0,
-    "Local Government entity": 3.0,
+    "Not a government entity": 1,
+    "State Government entity": 2,
+    "Local Government entity": 3,
 }
 QUANTITATIVE_VALUES  = {
     "Days away from work": "total_dafw_days",
@@ -56,41 +53,23 @@ QUANTITATIVE_VALUES  = {
     "Number of injuries": "total_injuries",
 }
 
-data = pd.concat(
-    list(
-        map(
-            lambda name: pd.read_csv(
-                name, encoding=FILE_NAMES_ENCODING[name], low_memory=False
-            ),
-            FILE_NAMES_ENCODING.keys(),
-        )
-    ),
-    ignore_index=True,
-)
+ROLLUP_DIMENSIONS = {
+    "State": "state",
+    "Year": "year_filing_for",
+    "NAICS sector": "naics_sector",
+    "Ownership": "establishment_type",
+}
+ROLLUP_RATES = {
+    "Injuries per 200,000 hours": "injury_rate",
+    "DAFW cases per 200,000 hours": "dafw_rate",
+    "DART cases per 200,000 hours": "dart_rate",
+}
 
-data = data.drop(
-    columns=[
-        "id",  # Unique number for each record
-        "street_address",
-        "zip_code",
-        "no_injuries_illnesses",  # Whether the establishment had any OSHA recordable work-related injuries or illnesses during the year
-        "total_other_cases",
-        "total_skin_disorders",
-        "total_poisonings",
-        "total_respiratory_conditions",
-        "total_hearing_loss",
-        "total_other_illnesses",
-        "created_timestamp",  # The date and time a record was submitted to the ITA
-        "change_reason",  # The reason why an establishment’s injury and illness summary was changed, if applicable
-    ]
-)
+# With MOBY_SHARED_DATASET=1 workers memory-map one copy of data and filter index (see 'shared_dataset')
+SHARED_DATASET = os.environ.get("MOBY_SHARED_DATASET") == "1"
 
-data = data[~data["year_filing_for"].isna()]
-data = data[data["annual_average_employees"] < 1000000]
-data = data[data["total_hours_worked"] >= 0]
-data = data[data["total_dafw_days"] >= 0]
-data = data[data["total_djtr_days"] >= 0]
-data.index = list(range(len(data)))
+# Dataset is loaded by the first page load, new or changed releases are ingested by holder (see 'ItaDatasetHolder')
+datasets = ItaDatasetHolder(shared=SHARED_DATASET)
 
 
 external_stylesheets = [
@@ -105,329 +84,380 @@ server = app.server
 app.title = "Moby Analytics"
 
 
-app.layout = html.Div(
-    children=[
-        html.Div(
-            children=[
-                html.H1(children="Moby Analytics", className="header-title"),
-                html.P(
-                    children="Analyze Establishment Specific Injury and Illness Data",
-                    className="header-description",
-                ),
-            ],
-            className="header",
-        ),
-        html.Div(
-            children=[
-                html.Div(
-                    children=[
-                        html.Div(children="State", className="menu-title"),
-                        dcc.Dropdown(
-                            id="state-filter",
-                            options=[
-                                {"label": state, "value": state}
-                                for state in np.append(ALL, data.state.unique())
-                            ],
-                            value=ALL,
-                            multi=True,
-                            clearable=True,
-                            searchable=True,
-                            className="dropdown",
-                        ),
-                    ],
-                    className="chart-label-small"
-                ),
-                html.Div(
-                    children=[
-                        html.Div(children="Year", className="menu-title"),
-                        dcc.Dropdown(
-                            id="year-filter",
-                            options=[
-                                {"label": year, "value": year}
-                                for year in np.append(
-                                    ALL, data.year_filing_for.unique()
-                                )
-                            ],
-                            value=ALL,
-                            clearable=True,
-                            searchable=True,
-                            className="dropdown",
-                        ),
-                    ],
-                    className="chart-label-small"
-                ),
-                html.Div(
-                    children=[
-                        html.Div(children="Ownership", className="menu-title"),
-                        dcc.Dropdown(
-                            id="ownership-filter",
-                            options=[
-                                {"label": state, "value": state}
-                                for state in [ALL] + list(OWNERSHIP_MAP.keys())
-                            ],
-                            value=ALL,
-                            clearable=True,
-                            searchable=True,
-                            className="dropdown",
-                        ),
-                    ],
-                    className="chart-label-small"
-                ),
-                html.Div(
-                    children=[
-                        html.Div(children="Naics", className="menu-title"),
-                        dcc.Dropdown(
-                            id="naics-filter",
-                            options=[
-                                {"label": state, "value": state}
-                                for state in [ALL] + list(set(TWO_DIGIT_NAICS.values()))
-                            ],
-                            value=ALL,
-                            clearable=True,
-                            searchable=True,
-                            className="dropdown",
-                        ),
-                    ],
-                    className="chart-label-small"
-                ),
-            ],
-            className="menu-row-1",
-        ),  # children=[]
-        html.Div(
-            className="menu-row-1",
-            children=[
-                html.Div(  ## HERE
-                    children=[
-                        html.Div(
-                            children="Days away from work", className="menu-title"
-                        ),
-                        dcc.RangeSlider(
-                            id="days_away_from_work-filter",
-                            min=data["total_dafw_days"].min(),
-                            max=data["total_dafw_days"].max(),
-                            value=[
-                                data["total_dafw_days"].min(),
-                                data["total_dafw_days"].max(),
-                            ],
-                        ),
-                    ],
-                    className="range-item"
-                ),
-                html.Div(  ## HERE
-                    children=[
-                        html.Div(children="Total hours worked", className="menu-title"),
-                        dcc.RangeSlider(
-                            id="total_hours_worked-filter",
-                            min=data["total_hours_worked"].min(),
-                            max=data["total_hours_worked"].max(),
-                            value=[
-                                data["total_hours_worked"].min(),
-                                data["total_hours_worked"].max(),
-                            ],
-                        ),
-                    ],
-                    className="range-item"
-                ),
-                html.Div(  ## HERE
-                    children=[
-                        html.Div(
-                            children="Annual average employees", className="menu-title"
-                        ),
-                        dcc.RangeSlider(
-                            id="annual_average_employees-filter",
-                            min=data["annual_average_employees"].min(),
-                            max=data["annual_average_employees"].max(),
-                            value=[
-                                data["annual_average_employees"].min(),
-                                data["annual_average_employees"].max(),
-                            ],
-                        ),
-                    ],
-                    className="range-item"
-                ),
-                html.Div(  ## HERE
-                    children=[
-                        html.Div(
-                            children="Days of job transfer or restriction",
-                            className="menu-title",
-                        ),
-                        dcc.RangeSlider(
-                            id="days_of_job_transfer_or_restriction-filter",
-                            min=data["total_djtr_days"].min(),
-                            max=data["total_djtr_days"].max(),
-                            value=[
-                                data["total_djtr_days"].min(),
-                                data["total_djtr_days"].max(),
-                            ],
-                            tooltip={"placement": "bottom", "always_visible": True},
-                        ),
-                    ],
-                    className="range-item"
-                ),
-            ],
-        ),
-        html.Div(
-            className="menu-row-1",
-            children=[
-                html.Div(  ## HERE
-                    children=[
-                        html.Div(
-                            children="Total Deaths",
-                            className="menu-title",
-                        ),
-                        dcc.RangeSlider(
-                            id="total_deaths-filter",
-                            min=data["total_deaths"].min(),
-                            max=data["total_deaths"].max(),
-                            value=[
-                                data["total_deaths"].min(),
-                                data["total_deaths"].max(),
-                            ],
-                        ),
-                    ],
-                    className="range-item"
-                ),
-                html.Div(  ## HERE
-                    children=[
-                        html.Div(
-                            children="Cases with days away from work",
-                            className="menu-title",
-                        ),
-                        dcc.RangeSlider(
-                            id="total_dafw_cases-filter",
-                            min=data["total_dafw_cases"].min(),
-                            max=data["total_dafw_cases"].max(),
-                            value=[
-                                data["total_dafw_cases"].min(),
-                                data["total_dafw_cases"].max(),
-                            ],
-                        ),
-                    ],
-                    className="range-item"
-                ),
-                html.Div(  ## HERE
-                    children=[
-                        html.Div(
-                            children="Cases with job transfer or restriction",
-                            className="menu-title",
-                        ),
-                        dcc.RangeSlider(
-                            id="total_djtr_cases-filter",
-                            min=data["total_djtr_cases"].min(),
-                            max=data["total_djtr_cases"].max(),
-                            value=[
-                                data["total_djtr_cases"].min(),
-                                data["total_djtr_cases"].max(),
-                            ],
-                        ),
-                    ],
-                    className="range-item"
-                ),
-                html.Div(  ## HERE
-                    children=[
-                        html.Div(
-                            children="Number of injuries",
-                            className="menu-title",
-                        ),
-                        dcc.RangeSlider(
-                            id="total_injuries-filter",
-                            min=data["total_injuries"].min(),
-                            max=data["total_injuries"].max(),
-                            value=[
-                                data["total_injuries"].min(),
-                                data["total_injuries"].max(),
-                            ],
-                        ),
-                    ],
-                    className="range-item"
-                ),
-            ],
-        ),
-        html.Div(
-            className="menu-row-1",
-            children=[
-                html.Div(
-                    children=[
-                        html.Div(children="X label", className="menu-title"),
-                        dcc.Dropdown(
-                            id="x_label-filter",
-                            options=[
-                                {"label": state, "value": state}
-                                for state in list(QUANTITATIVE_VALUES.keys())
-                            ],
-                            value=list(QUANTITATIVE_VALUES.keys())[0],
-                            searchable=True,
-                            className="dropdown",
+def serve_layout():
+    """Returns layout for every page load, so that options and bounds of sliders follow the current data
+    (e.g. new years and maxima after releases are ingested while app runs)."""
+    # Releases are ingested first if cache is empty, and callbacks of the page need the dataset anyway
+    datasets.get()
+    metadata = get_ita_metadata()
+    return html.Div(
+        children=[
+            html.Div(
+                children=[
+                    html.H1(children="Moby Analytics", className="header-title"),
+                    html.P(
+                        children="Analyze Establishment Specific Injury and Illness Data",
+                        className="header-description",
+                    ),
+                ],
+                className="header",
+            ),
+            html.Div(
+                children=[
+                    html.Div(
+                        children=[
+                            html.Div(children="State", className="menu-title"),
+                            dcc.Dropdown(
+                                id="state-filter",
+                                options=[
+                                    {"label": state, "value": state}
+                                    for state in [ALL] + metadata["states"]
+                                ],
+                                value=ALL,
+                                multi=True,
+                                clearable=True,
+                                searchable=True,
+                                className="dropdown",
+                            ),
+                        ],
+                        className="chart-label-small"
+                    ),
+                    html.Div(
+                        children=[
+                            html.Div(children="Year", className="menu-title"),
+                            dcc.Dropdown(
+                                id="year-filter",
+                                options=[
+                                    {"label": year, "value": year}
+                                    for year in [ALL] + [str(year) for year in metadata["years"]]
+                                ],
+                                value=ALL,
+                                clearable=True,
+                                searchable=True,
+                                className="dropdown",
+                            ),
+                        ],
+                        className="chart-label-small"
+                    ),
+                    html.Div(
+                        children=[
+                            html.Div(children="Ownership", className="menu-title"),
+                            dcc.Dropdown(
+                                id="ownership-filter",
+                                options=[
+                                    {"label": state, "value": state}
+                                    for state in [ALL] + list(OWNERSHIP_MAP.keys())
+                                ],
+                                value=ALL,
+                                clearable=True,
+                                searchable=True,
+                                className="dropdown",
+                            ),
+                        ],
+                        className="chart-label-small"
+                    ),
+                    html.Div(
+                        children=[
+                            html.Div(children="Naics", className="menu-title"),
+                            dcc.Dropdown(
+                                id="naics-filter",
+                                options=[{"label": ALL, "value": ALL}] + metadata["naics_options"],
+                                value=ALL,
+                                multi=True,
+                                clearable=True,
+                                searchable=True,
+                                className="dropdown",
+                            ),
+                        ],
+                        className="chart-label-small"
+                    ),
+                ],
+                className="menu-row-1",
+            ),  # children=[]
+            html.Div(
+                className="menu-row-1",
+                children=[
+                    html.Div(  ## HERE
+                        children=[
+                            html.Div(
+                                children="Days away from work", className="menu-title"
+                            ),
+                            dcc.RangeSlider(
+                                id="days_away_from_work-filter",
+                                min=metadata["ranges"]["total_dafw_days"][0],
+                                max=metadata["ranges"]["total_dafw_days"][1],
+                                value=metadata["ranges"]["total_dafw_days"],
+                            ),
+                        ],
+                        className="range-item"
+                    ),
+                    html.Div(  ## HERE
+                        children=[
+                            html.Div(children="Total hours worked", className="menu-title"),
+                            dcc.RangeSlider(
+                                id="total_hours_worked-filter",
+                                min=metadata["ranges"]["total_hours_worked"][0],
+                                max=metadata["ranges"]["total_hours_worked"][1],
+                                value=metadata["ranges"]["total_hours_worked"],
+                            ),
+                        ],
+                        className="range-item"
+                    ),
+                    html.Div(  ## HERE
+                        children=[
+                            html.Div(
+                                children="Annual average employees", className="menu-title"
+                            ),
+                            dcc.RangeSlider(
+                                id="annual_average_employees-filter",
+                                min=metadata["ranges"]["annual_average_employees"][0],
+                                max=metadata["ranges"]["annual_average_employees"][1],
+                                value=metadata["ranges"]["annual_average_employees"],
+                            ),
+                        ],
+                        className="range-item"
+                    ),
+                    html.Div(  ## HERE
+                        children=[
+                            html.Div(
+                                children="Days of job transfer or restriction",
+                                className="menu-title",
+                            ),
+                            dcc.RangeSlider(
+                                id="days_of_job_transfer_or_restriction-filter",
+                                min=metadata["ranges"]["total_djtr_days"][0],
+                                max=metadata["ranges"]["total_djtr_days"][1],
+                                value=metadata["ranges"]["total_djtr_days"],
+                                tooltip={"placement": "bottom", "always_visible": True},
+                            ),
+                        ],
+                        className="range-item"
+                    ),
+                ],
+            ),
+            html.Div(
+                className="menu-row-1",
+                children=[
+                    html.Div(  ## HERE
+                        children=[
+                            html.Div(
+                                children="Total Deaths",
+                                className="menu-title",
+                            ),
+                            dcc.RangeSlider(
+                                id="total_deaths-filter",
+                                min=metadata["ranges"]["total_deaths"][0],
+                                max=metadata["ranges"]["total_deaths"][1],
+                                value=metadata["ranges"]["total_deaths"],
+                            ),
+                        ],
+                        className="range-item"
+                    ),
+                    html.Div(  ## HERE
+                        children=[
+                            html.Div(
+                                children="Cases with days away from work",
+                                className="menu-title",
+                            ),
+                            dcc.RangeSlider(
+                                id="total_dafw_cases-filter",
+                                min=metadata["ranges"]["total_dafw_cases"][0],
+                                max=metadata["ranges"]["total_dafw_cases"][1],
+                                value=metadata["ranges"]["total_dafw_cases"],
+                            ),
+                        ],
+                        className="range-item"
+                    ),
+                    html.Div(  ## HERE
+                        children=[
+                            html.Div(
+                                children="Cases with job transfer or restriction",
+                                className="menu-title",
+                            ),
+                            dcc.RangeSlider(
+                                id="total_djtr_cases-filter",
+                                min=metadata["ranges"]["total_djtr_cases"][0],
+                                max=metadata["ranges"]["total_djtr_cases"][1],
+                                value=metadata["ranges"]["total_djtr_cases"],
+                            ),
+                        ],
+                        className="range-item"
+                    ),
+                    html.Div(  ## HERE
+                        children=[
+                            html.Div(
+                                children="Number of injuries",
+                                className="menu-title",
+                            ),
+                            dcc.RangeSlider(
+                                id="total_injuries-filter",
+                                min=metadata["ranges"]["total_injuries"][0],
+                                max=metadata["ranges"]["total_injuries"][1],
+                                value=metadata["ranges"]["total_injuries"],
+                            ),
+                        ],
+                        className="range-item"
+                    ),
+                ],
+            ),
+            html.Div(
+                className="menu-row-1",
+                children=[
+                    html.Div(
+                        children=[
+                            html.Div(children="X label", className="menu-title"),
+                            dcc.Dropdown(
+                                id="x_label-filter",
+                                options=[
+                                    {"label": state, "value": state}
+                                    for state in list(QUANTITATIVE_VALUES.keys())
+                                ],
+                                value=list(QUANTITATIVE_VALUES.keys())[0],
+                                searchable=True,
+                                className="dropdown",
+                            ),
+                        ],
+                        className="chart-label"
+                    ),
+                    html.Div(
+                        children=[
+                            html.Div(children="Y label", className="menu-title"),
+                            dcc.Dropdown(
+                                id="y_label-filter",
+                                options=[
+                                    {"label": state, "value": state}
+                                    for state in list(QUANTITATIVE_VALUES.keys())
+                                ],
+                                value=list(QUANTITATIVE_VALUES.keys())[-1],
+                                searchable=True,
+                                className="dropdown",
+                            ),
+                        ],
+                        className="chart-label"
+                    ),
+                    # html.Div(
+                    #     children=[
+                    #         html.Div(children="Colors", className="menu-title"),
+                    #         dcc.Dropdown(
+                    #             id="colors-filter",
+                    #             options=[
+                    #                 {"label": state, "value": state}
+                    #                 for state in list(QUANTITATIVE_VALUES.keys())
+                    #             ],
+                    #             value="State",
+                    #             searchable=True,
+                    #             className="dropdown",
+                    #         ),
+                    #     ],
+                    # ),
+                ],
+            ),
+            html.Div(
+                children=[
+                    dash_table.DataTable(
+                        id='moby-table',
+                        # The first page is loaded by 'update_table' callback
+                        data=[],
+                        columns=[{'id': c, 'name': c} for c in metadata["columns"]],
+                        page_current=0,
+                        page_size=TABLE_PAGE_SIZE,
+                        page_action='custom',
+                        sort_action='custom',
+                        sort_mode='multi',
+                        sort_by=[],
+                        filter_action='custom',
+                        filter_query='',
+                        fixed_rows={'headers': True},
+                        style_cell={'minWidth': 95, 'width': 120, 'maxWidth': 120},
+                    ),
+                ],
+                className="wrapper",
+            ),
+            html.Div(
+                children=[
+                    dcc.RadioItems(
+                        id="download-format",
+                        options=[
+                            {"label": "CSV", "value": "csv"},
+                            {"label": "CSV (gzip)", "value": "csv.gz"},
+                            {"label": "Parquet", "value": "parquet"},
+                        ],
+                        value="csv",
+                        inline=True,
+                    ),
+                    html.A(
+                        html.Button("Download", id="download-button"),
+                        id="download-link",
+                        href="",
+                    ),
+                ],
+                className="wrapper",
+            ),
+            html.Div(
+                children=[
+                    html.Div(
+                        children=dcc.Graph(
+                            id="price-chart",
                         ),
-                    ],
-                    className="chart-label"
-                ),
-                html.Div(
-                    children=[
-                        html.Div(children="Y label", className="menu-title"),
-                        dcc.Dropdown(
-                            id="y_label-filter",
-                            options=[
-                                {"label": state, "value": state}
-                                for state in list(QUANTITATIVE_VALUES.keys())
-                            ],
-                            value=list(QUANTITATIVE_VALUES.keys())[-1],
-                            searchable=True,
-                            className="dropdown",
+                        className="card",
+                    )
+                ],
+                className="wrapper",
+            ),
+            html.Div(
+                children=[
+                    html.Div(
+                        children=[
+                            html.Div(children="Group by", className="menu-title"),
+                            dcc.Dropdown(
+                                id="rollup-group-by",
+                                options=[
+                                    {"label": label, "value": dimension}
+                                    for label, dimension in ROLLUP_DIMENSIONS.items()
+                                ],
+                                value=["state"],
+                                multi=True,
+                                className="dropdown",
+                            ),
+                        ],
+                        className="chart-label"
+                    ),
+                    html.Div(
+                        children=[
+                            html.Div(children="Rate", className="menu-title"),
+                            dcc.Dropdown(
+                                id="rollup-rate",
+                                options=[{"label": label, "value": rate} for label, rate in ROLLUP_RATES.items()],
+                                value="injury_rate",
+                                clearable=False,
+                                className="dropdown",
+                            ),
+                        ],
+                        className="chart-label"
+                    ),
+                ],
+            ),
+            html.Div(
+                children=[
+                    html.Div(
+                        children=dcc.Graph(
+                            id="rollup-chart",
                         ),
-                    ],
-                    className="chart-label"
-                ),
-                # html.Div(
-                #     children=[
-                #         html.Div(children="Colors", className="menu-title"),
-                #         dcc.Dropdown(
-                #             id="colors-filter",
-                #             options=[
-                #                 {"label": state, "value": state}
-                #                 for state in list(QUANTITATIVE_VALUES.keys())
-                #             ],
-                #             value="State",
-                #             searchable=True,
-                #             className="dropdown",
-                #         ),
-                #     ],
-                # ),
-            ],
-        ),
-        html.Div(
-            children=[
-                dash_table.DataTable(
-                    id='moby-table',
-                    data=data.to_dict('records'),
-                    columns=[{'id': c, 'name': c} for c in data.columns],
-                    virtualization=True,
-                    fixed_rows={'headers': True},
-                    style_cell={'minWidth': 95, 'width': 120, 'maxWidth': 120},
-                ),
-            ],
-            className="wrapper",
-        ),
-        html.Div(
-            children=[
-                html.Button("Download CSV", id="download-button", n_clicks=1),
-                dcc.Download(id="download-dataframe-csv"),
-            ],
-            className="wrapper",
-        ),
-        html.Div(
-            children=[
-                html.Div(
-                    children=dcc.Graph(
-                        id="price-chart",
+                        className="card",
                     ),
-                    className="card",
-                )
-            ],
-            className="wrapper",
-        ),
-    ]
-)
+                    dash_table.DataTable(
+                        id="rollup-table",
+                        page_size=TABLE_PAGE_SIZE,
+                        sort_action="native",
+                    ),
+                ],
+                className="wrapper",
+            ),
+        ]
+    )
+
+
+app.layout = serve_layout
 
 # [state-filter, year-filter, ownership-filter, naics-filter, days_away_from_work-filter, total_hours_worked-filter,
 # annual_average_employees-filter, days_of_job_transfer_or_restriction-filter, total_deaths-filter, total_dafw_cases-filter,
@@ -469,7 +499,8 @@ def update_charts(
     x_label,
     y_label
 ):
-    t = update_df(state,
+    dataset = datasets.get()
+    positions = update_positions(dataset, state,
     year,
     ownership_type,
     naics,
@@ -482,15 +513,15 @@ def update_charts(
     total_djtr_cases,
     total_injuries,)
 
-    price_chart_figure = px.scatter(
-        t, x=QUANTITATIVE_VALUES[x_label], y=QUANTITATIVE_VALUES[y_label],
-        color="state", log_x=True, size_max=100
-    )
+    x, y = QUANTITATIVE_VALUES[x_label], QUANTITATIVE_VALUES[y_label]
+    # Only the drawn columns are taken from the filtered rows
+    t = dataset.data[list(dict.fromkeys([x, y, "state"]))].take(positions)
+    price_chart_figure = build_scatter_chart(t, x=x, y=y, color="state")
     return price_chart_figure
 
 
 @app.callback(
-    Output("moby-table", "data"),
+    [Output("moby-table", "data"), Output("moby-table", "page_count")],
     [
         Input("state-filter", "value"),
         Input("year-filter", "value"),
@@ -506,6 +537,10 @@ def update_charts(
         Input("total_dafw_cases-filter", "value"),
         Input("total_djtr_cases-filter", "value"),
         Input("total_injuries-filter", "value"),
+        Input("moby-table", "page_current"),
+        Input("moby-table", "page_size"),
+        Input("moby-table", "sort_by"),
+        Input("moby-table", "filter_query"),
     ],
 )
 def update_table(
@@ -521,8 +556,13 @@ def update_table(
     total_dafw_cases,
     total_djtr_cases,
     total_injuries,
+    page_current,
+    page_size,
+    sort_by,
+    filter_query,
 ):
-    t = update_df(state,
+    dataset = datasets.get()
+    positions = update_positions(dataset, state,
     year,
     ownership_type,
     naics,
@@ -535,32 +575,28 @@ def update_table(
     total_djtr_cases,
     total_injuries,)
 
-    records = t.to_dict('records')
-
-    return records
+    return get_table_page(dataset.data, positions, page_current, page_size, sort_by, filter_query)
 
 
 @app.callback(
-    Output("download-dataframe-csv", "data"),
-    Input("download-button", "n_clicks"),
+    Output("download-link", "href"),
     [
-        State("state-filter", "value"),
-        State("year-filter", "value"),
-        State("ownership-filter", "value"),
-        State("naics-filter", "value"),
-        State("days_away_from_work-filter", "value"),
-        State("total_hours_worked-filter", "value"),
-        State("annual_average_employees-filter", "value"),
-        State("days_of_job_transfer_or_restriction-filter", "value"),
-        State("total_deaths-filter", "value"),
-        State("total_dafw_cases-filter", "value"),
-        State("total_djtr_cases-filter", "value"),
-        State("total_injuries-filter", "value"),
+        Input("state-filter", "value"),
+        Input("year-filter", "value"),
+        Input("ownership-filter", "value"),
+        Input("naics-filter", "value"),
+        Input("days_away_from_work-filter", "value"),
+        Input("total_hours_worked-filter", "value"),
+        Input("annual_average_employees-filter", "value"),
+        Input("days_of_job_transfer_or_restriction-filter", "value"),
+        Input("total_deaths-filter", "value"),
+        Input("total_dafw_cases-filter", "value"),
+        Input("total_djtr_cases-filter", "value"),
+        Input("total_injuries-filter", "value"),
+        Input("download-format", "value"),
     ],
-    prevent_initial_call=True,
 )
-def download_csv(
-    n_clicks,
+def update_download_link(
     state,
     year,
     ownership_type,
@@ -573,8 +609,9 @@ def download_csv(
     total_dafw_cases,
     total_djtr_cases,
     total_injuries,
+    export_format,
 ):
-    t = update_df(state,
+    filter_values = [state,
     year,
     ownership_type,
     naics,
@@ -585,12 +622,99 @@ def download_csv(
     total_deaths,
     total_dafw_cases,
     total_djtr_cases,
-    total_injuries,)
+    total_injuries,]
+
+    query = urllib.parse.urlencode({"filters": json.dumps(filter_values), "format": export_format})
+    return f'{app.get_relative_path("/export")}?{query}'
+
+
+@server.route(f"{app.config.routes_pathname_prefix}export")
+def export_filtered_rows():
+    """Streams rows matching filter values from 'filters' query parameter (JSON list in the order of
+    'update_positions' arguments) in one of EXPORT_FORMATS."""
+    export_format = request.args.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        abort(400, f"Unknown export format: {export_format}")
+    dataset = datasets.get()
+    try:
+        positions = update_positions(dataset, *json.loads(request.args["filters"]))
+    except (KeyError, ValueError, TypeError) as error:
+        abort(400, f"Invalid filters: {error}")
+    extension, mimetype = EXPORT_FORMATS[export_format]
+    filename = f'{pd.to_datetime("today").strftime("%Y-%m-%d_%H-%M-%S")}.{extension}'
+    return Response(
+        stream_with_context(iter_export(dataset.data, positions, export_format)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
-    return dcc.send_data_frame(t.to_csv, filename=f'{pd.to_datetime("today").strftime("%Y-%m-%d_%H-%M-%S")}.csv')
 
+def get_cube_filters(state, year, ownership_type):
+    """Returns filters of 'RollupCube.query' for values of state, year and ownership filters."""
+    filters = {}
+    if ALL not in state:
+        filters["state"] = state
+    if year and ALL not in year:
+        filters["year_filing_for"] = [int(year)]
+    if ALL not in ownership_type:
+        filters["establishment_type"] = [OWNERSHIP_MAP[ownership_type]]
+    return filters
 
-def update_df(
+
+@app.callback(
+    [
+        Output("rollup-chart", "figure"),
+        Output("rollup-table", "data"),
+        Output("rollup-table", "columns"),
+    ],
+    [
+        Input("state-filter", "value"),
+        Input("year-filter", "value"),
+        Input("ownership-filter", "value"),
+        Input("rollup-group-by", "value"),
+        Input("rollup-rate", "value"),
+    ],
+)
+def update_rollup(state, year, ownership_type, group_by, rate):
+    """Shows totals and rates from the rollup cube. NAICS and range filters don't apply, because cube keeps only
+    sums by state, year, NAICS sector and ownership."""
+    group_by = group_by or []
+    result = datasets.get().cube.query(group_by, get_cube_filters(state, year, ownership_type))
+    # Dimension values are shown as categories, e.g. years aren't drawn on continuous axis. Columns are passed by
+    # name, so axis and legend are titled by dimensions
+    figure = px.bar(
+        result.astype({dimension: str for dimension in group_by}),
+        x=group_by[0] if group_by else ["Total"] * len(result),
+        y=rate,
+        color=group_by[1] if len(group_by) > 1 else None,
+        barmode="group",
+        hover_data=group_by + ["establishments", "total_hours_worked"],
+        # Unnamed list of the total is titled 'x' by plotly
+        labels=None if group_by else {"x": ""},
+    )
+    figure.update_xaxes(type="category")
+    return figure, result.to_dict("records"), [{"id": column, "name": column} for column in result.columns]
+
+
+@server.route(f"{app.config.routes_pathname_prefix}api/rollup")
+def query_rollup():
+    """Returns JSON records from 'RollupCube.query'. 'group_by' parameter is comma-separated list of CUBE_DIMENSIONS,
+    every dimension parameter is comma-separated list of values, e.g. ?group_by=state&year_filing_for=2020,2021"""
+    group_by = [dimension for dimension in request.args.get("group_by", "").split(",") if dimension]
+    filters = {}
+    try:
+        for dimension in CUBE_DIMENSIONS:
+            if dimension in request.args:
+                values = request.args[dimension].split(",")
+                filters[dimension] = list(map(int, values)) if dimension in INTEGER_CUBE_DIMENSIONS else values
+        result = datasets.get().cube.query(group_by, filters)
+    except ValueError as error:
+        abort(400, f"Invalid query: {error}")
+    return Response(result.to_json(orient="records"), mimetype="application/json")
+
+
+def update_positions(
+    dataset,
     state,
     year,
     ownership_type,
@@ -604,48 +728,22 @@ def update_df(
     total_djtr_cases,
     total_injuries,
 ):
-    t = data if ALL in state else data[data["state"].isin(state)]
-    t = (
-        t
-        if ALL in naics
-        else t[
-            t["naics_code"]
-            .astype(str)
-            .str.startswith(tuple(get_naics_sector_numbers_by_names([naics])))
-        ]
-    )
-    t = (
-        t
-        if (not year or ALL in year)
-        else t[t["year_filing_for"].isin([np.float64(year)])]
-    )
-    t = (
-        t
-        if ALL in ownership_type
-        else t[t["establishment_type"].isin([OWNERSHIP_MAP[ownership_type]])]
+    return dataset.index.filter_positions(
+        states=None if ALL in state else state,
+        years=None if (not year or ALL in year) else [int(year)],
+        ownership_types=None if ALL in ownership_type else [OWNERSHIP_MAP[ownership_type]],
+        naics_prefixes=None if not naics or ALL in naics else naics,
+        ranges={
+            "annual_average_employees": employee_number_range,
+            "total_hours_worked": total_hours_worked_range,
+            "total_dafw_days": days_away_from_work,
+            "total_djtr_days": days_of_job_transfer_or_restriction,
+            "total_deaths": total_deaths,
+            "total_dafw_cases": total_dafw_cases,
+            "total_djtr_cases": total_djtr_cases,
+            "total_injuries": total_injuries,
+        },
     )
-    t = t[
-        t["annual_average_employees"].between(
-            employee_number_range[0], employee_number_range[1]
-        )
-    ]
-    t = t[
-        t["total_hours_worked"].between(
-            total_hours_worked_range[0], total_hours_worked_range[1]
-        )
-    ]
-    t = t[t["total_dafw_days"].between(days_away_from_work[0], days_away_from_work[1])]
-    t = t[
-        t["total_djtr_days"].between(
-            days_of_job_transfer_or_restriction[0],
-            days_of_job_transfer_or_restriction[1],
-        )
-    ]
-    t = t[t["total_deaths"].between(total_deaths[0], total_deaths[1])]
-    t = t[t["total_dafw_cases"].between(total_dafw_cases[0], total_dafw_cases[1])]
-    t = t[t["total_djtr_cases"].between(total_djtr_cases[0], total_djtr_cases[1])]
-    t = t[t["total_injuries"].between(total_injuries[0], total_injuries[1])]
-    return t
 
 if __name__ == "__main__":
     app.run_server(debug=True, port=8060)
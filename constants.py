@@ -1,8 +1,11 @@
 """Module contains all constants that are used in multiple modules."""
 import json
 import os
+import pickle
+import threading
+from functools import lru_cache
 
-from typing import Dict, List, AnyStr
+from typing import Any, Callable, Dict, List, AnyStr, Tuple, TypeVar
 
 
 LAST_DATE_OF_INTEREST = '2020-01-01'
@@ -12,25 +15,103 @@ ALL = 'ALL'
 PROJECT_NAME = 'MOBY'
 INSPECTION_DETAILS_FOLDER_NAME = 'Inspections'
 MAPPING_FILES_FOLDER_NAME = 'Mapping_files_for_values_in_columns'
+CACHE_FOLDER_NAME = 'Cache'
 
 
 # Type-related constants
 NULL_INT = -1
 NULL_STRING = ''
 
+T = TypeVar('T')
 
-# Loading JSON files. Changing current working directory is needed to prevent
-# 'FileNotFoundError' when working in Jupyter Notebooks in 'Datasets' folder.
-
-with open(f"{MAPPING_FILES_FOLDER_NAME}/EMPLOYER_NORMALIZED_NAMES.json", 'r', encoding='utf-8') as f:
-    EMPLOYER_NORMALIZED_NAMES = json.load(f)
-with open(f"{MAPPING_FILES_FOLDER_NAME}/FATALITY_OR_CATASTROPHE_NAMES.json", 'r', encoding='utf-8') as f:
-    FATALITY_OR_CATASTROPHE_NAMES = json.load(f)
-with open(f"{MAPPING_FILES_FOLDER_NAME}/FOUR_DIGIT_NAICS.json", 'r', encoding='utf-8') as f:
-    FOUR_DIGIT_NAICS = json.load(f)
-with open(f"{MAPPING_FILES_FOLDER_NAME}/NAICS_AGGREGATION_LEVELS.json", 'r', encoding='utf-8') as f:
-    NAICS_AGGREGATION_LEVELS = json.load(f)
-with open(f"{MAPPING_FILES_FOLDER_NAME}/STATE_NAMES.json", 'r', encoding='utf-8') as f:
-    STATE_NAMES = json.load(f)
-with open(f"{MAPPING_FILES_FOLDER_NAME}/TWO_DIGIT_NAICS.json", 'r', encoding='utf-8') as f:
-    TWO_DIGIT_NAICS = json.load(f)
+
+# Mapping JSON files are loaded on first access of their constants (e.g. 'constants.STATE_NAMES'), so importing
+# modules which don't use them is cheap. Paths are relative to this file, not to current working directory.
+PACKAGE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+MAPPING_FILES_FOLDER = os.path.join(PACKAGE_FOLDER, MAPPING_FILES_FOLDER_NAME)
+MAPPING_NAMES = (
+    'EMPLOYER_NORMALIZED_NAMES',
+    'FATALITY_OR_CATASTROPHE_NAMES',
+    'FOUR_DIGIT_NAICS',
+    'NAICS_AGGREGATION_LEVELS',
+    'STATE_NAMES',
+    'TWO_DIGIT_NAICS',
+)
+# Structures derived from mappings (e.g. inverse maps) can be pickled here and are rebuilt when mapping files or
+# module that builds them change. Set MOBY_MAPPING_CACHE=1 to enable it, current mappings are built in milliseconds.
+MAPPING_CACHE_PATH = os.path.join(PACKAGE_FOLDER, CACHE_FOLDER_NAME, 'mapping_cache.pickle')
+USE_MAPPING_CACHE = os.environ.get('MOBY_MAPPING_CACHE') == '1'
+
+_derived_mappings: Dict[str, Any] = {}
+_derived_mappings_lock = threading.Lock()
+
+
+def get_mapping_path(name: str) -> str:
+    return os.path.join(MAPPING_FILES_FOLDER, f"{name}.json")
+
+
+@lru_cache(maxsize=None)
+def load_mapping(name: str) -> dict:
+    """Returns parsed JSON file of mapping, it is read only once."""
+    if name not in MAPPING_NAMES:
+        raise ValueError(f"Unknown mapping: {name}")
+    with open(get_mapping_path(name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def __getattr__(name: str):
+    """Loads mapping constants on first access (PEP 562). Loaded mapping is kept in module, so later accesses
+    don't call this function."""
+    if name in MAPPING_NAMES:
+        mapping = globals()[name] = load_mapping(name)
+        return mapping
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def _get_cache_stamp(build: Callable) -> Tuple:
+    """Returns sizes and modification times of mapping files and of file with 'build' function."""
+    paths = [get_mapping_path(name) for name in MAPPING_NAMES] + [build.__code__.co_filename]
+    return tuple((path, os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in paths if os.path.exists(path))
+
+
+def _read_mapping_cache() -> Dict[str, Tuple[Tuple, Any]]:
+    """Returns key: (stamp, structure) from cache file, empty dictionary if it can't be read."""
+    try:
+        with open(MAPPING_CACHE_PATH, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return {}
+
+
+def _write_mapping_cache(key: str, stamp: Tuple, structure) -> None:
+    """Adds structure to cache file. File is replaced at once, so concurrent readers never see a partial file."""
+    cache = _read_mapping_cache()
+    cache[key] = (stamp, structure)
+    try:
+        os.makedirs(os.path.dirname(MAPPING_CACHE_PATH), exist_ok=True)
+        temporary_path = f"{MAPPING_CACHE_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, MAPPING_CACHE_PATH)
+    except OSError as error:  # Cache is optional, e.g. package folder can be read-only
+        print(f"Can't write mapping cache: {error}")
+
+
+def get_derived_mapping(key: str, build: Callable[[], T]) -> T:
+    """Returns structure built from mappings by 'build' (e.g. inverse map), it is built only once per process.
+    If USE_MAPPING_CACHE, structure is taken from MAPPING_CACHE_PATH when it is up to date, otherwise it is built
+    and saved there."""
+    if key in _derived_mappings:
+        return _derived_mappings[key]
+    with _derived_mappings_lock:
+        if key not in _derived_mappings:
+            if not USE_MAPPING_CACHE:
+                _derived_mappings[key] = build()
+            else:
+                stamp = _get_cache_stamp(build)
+                cached_stamp, structure = _read_mapping_cache().get(key, (None, None))
+                if cached_stamp != stamp:
+                    structure = build()
+                    _write_mapping_cache(key, stamp, structure)
+                _derived_mappings[key] = structure
+        return _derived_mappings[key]
@@ -0,0 +1,85 @@
+"""Module for streaming export of filtered rows in chunks, so that memory usage doesn't depend on export size."""
+import io
+import zlib
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import parquet
+
+EXPORT_CHUNK_SIZE = 50_000
+# File extension, MIME type
+EXPORT_FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "csv.gz": ("csv.gz", "application/gzip"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """Writable file that keeps written bytes until they are taken. Position is counted over all written bytes,
+    because Parquet writer stores offsets of row groups in the file footer."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_chunks(df: pd.DataFrame, positions: np.ndarray, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Yields rows of dataframe at positions in chunks. At least one (maybe empty) chunk is yielded."""
+    for start in range(0, max(len(positions), 1), chunk_size):
+        yield df.take(positions[start: start + chunk_size])
+
+
+def iter_csv(df: pd.DataFrame, positions: np.ndarray, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yields CSV file with rows of dataframe at positions, header is written only once."""
+    for index, chunk in enumerate(iter_chunks(df, positions, chunk_size)):
+        yield chunk.to_csv(header=index == 0).encode("utf-8")
+
+
+def iter_gzip(data_chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Compresses stream of bytes to gzip format."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for data in data_chunks:
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_parquet(df: pd.DataFrame, positions: np.ndarray, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yields Parquet file with rows of dataframe at positions, every chunk is written as a separate row group."""
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    sink = _ChunkSink()
+    with parquet.ParquetWriter(sink, schema) as writer:
+        for chunk in iter_chunks(df, positions, chunk_size):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.take()
+    yield sink.take()
+
+
+def iter_export(df: pd.DataFrame, positions: np.ndarray, export_format: str) -> Iterator[bytes]:
+    """Yields file in one of EXPORT_FORMATS with rows of dataframe at positions."""
+    if export_format == "parquet":
+        return iter_parquet(df, positions)
+    if export_format == "csv.gz":
+        return iter_gzip(iter_csv(df, positions))
+    return iter_csv(df, positions)
@@ -0,0 +1,212 @@
+"""Module contains index that is built once over ITA dataframe and resolves dashboard filters to row positions."""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import reduce
+from typing import Dict, Hashable, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from naics_codes import get_padded_codes, get_prefix_ranges
+
+RANGE_COLUMNS = [
+    "total_dafw_days",
+    "total_hours_worked",
+    "annual_average_employees",
+    "total_djtr_days",
+    "total_deaths",
+    "total_dafw_cases",
+    "total_djtr_cases",
+    "total_injuries",
+]
+FILTER_CACHE_SIZE = 32
+BITSET_ATTRIBUTES = ["state_bitsets", "year_bitsets", "ownership_bitsets"]
+
+
+class FilterIndex:
+    """Per-value bitsets (packed with 'np.packbits') for 'state', 'year_filing_for' and 'establishment_type', and
+    sorted arrays for numeric columns in RANGE_COLUMNS and for NAICS codes padded with 'get_padded_codes', so that
+    codes with any prefix are a contiguous slice. Every filter is resolved to a bitset, bitsets are intersected, and rows are
+    selected from dataframe with single 'take'.
+    Results are kept in LRU cache keyed on normalized filters, so all callbacks with the same filter values
+    share one computation."""
+
+    def __init__(self, df: pd.DataFrame, cache_size: int = FILTER_CACHE_SIZE):
+        self._init_cache(df, cache_size)
+        self.state_bitsets = self._build_value_bitsets(df["state"])
+        self.year_bitsets = self._build_value_bitsets(df["year_filing_for"])
+        self.ownership_bitsets = self._build_value_bitsets(df["establishment_type"])
+        # Padded codes have 7 digits, so they are stored as int32
+        self.naics_codes = self._build_sorted_column(pd.Series(get_padded_codes(df["naics_code"])).astype("Int32"))
+        self.sorted_columns = {column: self._build_sorted_column(df[column]) for column in RANGE_COLUMNS}
+
+    def _init_cache(self, df: pd.DataFrame, cache_size: int) -> None:
+        self.df = df
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.row_count = len(df)
+
+    def to_arrays(self) -> Tuple[Dict[str, np.ndarray], Dict[str, list]]:
+        """Returns arrays of index by name and values of bitsets in the order of their rows, e.g. to save arrays
+        with 'np.save' and values as JSON. See 'from_arrays'."""
+        arrays, bitset_values = {}, {}
+        for name in BITSET_ATTRIBUTES:
+            bitsets = getattr(self, name)
+            bitset_values[name] = [value.item() if isinstance(value, np.generic) else value for value in bitsets]
+            arrays[name] = (np.stack(list(bitsets.values())) if bitsets
+                            else np.zeros((0, (self.row_count + 7) // 8), dtype=np.uint8))
+        arrays["naics_codes.values"], arrays["naics_codes.positions"] = self.naics_codes
+        for column, (values, positions) in self.sorted_columns.items():
+            arrays[f"{column}.values"], arrays[f"{column}.positions"] = values, positions
+        return arrays, bitset_values
+
+    @classmethod
+    def from_arrays(
+        cls,
+        df: pd.DataFrame,
+        arrays: Dict[str, np.ndarray],
+        bitset_values: Dict[str, list],
+        cache_size: int = FILTER_CACHE_SIZE,
+    ) -> "FilterIndex":
+        """Returns index over df with arrays from 'to_arrays' instead of building them, e.g. arrays memory-mapped
+        with 'np.load(..., mmap_mode="r")' are shared by all processes which load them."""
+        index = cls.__new__(cls)
+        index._init_cache(df, cache_size)
+        for name in BITSET_ATTRIBUTES:
+            setattr(index, name, dict(zip(bitset_values[name], arrays[name])))
+        index.naics_codes = arrays["naics_codes.values"], arrays["naics_codes.positions"]
+        index.sorted_columns = {
+            column: (arrays[f"{column}.values"], arrays[f"{column}.positions"]) for column in RANGE_COLUMNS
+        }
+        return index
+
+    @staticmethod
+    def _build_value_bitsets(column: pd.Series) -> Dict[Hashable, np.ndarray]:
+        """Returns packed bitset of rows for every non-null value in column."""
+        codes, uniques = pd.factorize(column)
+        return {value: np.packbits(codes == code) for code, value in enumerate(uniques)}
+
+    @staticmethod
+    def _build_sorted_column(column: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns sorted non-null values of column in its own NumPy dtype (e.g. int32 for Int32) and positions of
+        rows they belong to as int32 (int64 for more than 2**31 rows). Missing values never match a range,
+        so their rows are left out."""
+        dtype = getattr(column.dtype, "numpy_dtype", column.dtype)
+        valid = ~column.isna().to_numpy()
+        values = column.to_numpy(dtype=dtype, na_value=0) if not valid.all() else column.to_numpy(dtype=dtype)
+        position_dtype = np.int32 if len(column) < 2 ** 31 else np.int64
+        positions = np.flatnonzero(valid).astype(position_dtype)
+        values = values[positions]
+        order = np.argsort(values, kind="stable")
+        return values[order], positions[order]
+
+    def _positions_to_bitset(self, positions: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.row_count, dtype=bool)
+        mask[positions] = True
+        return np.packbits(mask)
+
+    def _union_bitset(self, bitsets: Dict[Hashable, np.ndarray], values: Iterable[Hashable]) -> np.ndarray:
+        """Returns bitset of rows which have any of values. Unknown values match no rows."""
+        empty = np.zeros((self.row_count + 7) // 8, dtype=np.uint8)
+        return reduce(np.bitwise_or, [bitsets.get(value, empty) for value in values], empty)
+
+    def _range_bounds(self, column: str, low: float, high: float) -> Optional[Tuple[int, int]]:
+        """Returns bounds of [low, high] range in sorted column, or None if range doesn't exclude any row."""
+        values, _ = self.sorted_columns[column]
+        if values.dtype.kind in "iu":
+            # Bounds of integer type, so that searchsorted doesn't convert the whole column to floats
+            limits = np.iinfo(values.dtype)
+            low = values.dtype.type(np.clip(np.ceil(low), limits.min, limits.max))
+            high = values.dtype.type(np.clip(np.floor(high), limits.min, limits.max))
+        start = int(np.searchsorted(values, low, side="left"))
+        end = int(np.searchsorted(values, high, side="right"))
+        if start == 0 and end == self.row_count:
+            return None
+        return start, end
+
+    def _naics_bounds(self, naics_prefixes: Iterable) -> Tuple[Tuple[int, int], ...]:
+        """Returns bounds of codes with any of prefixes in sorted NAICS codes."""
+        values, _ = self.naics_codes
+        return tuple(
+            (int(np.searchsorted(values, start, side="left")), int(np.searchsorted(values, end, side="left")))
+            for start, end in get_prefix_ranges(naics_prefixes)
+        )
+
+    def _get_filter_key(self, states, years, ownership_types, naics_prefixes, ranges) -> Tuple:
+        """Returns hashable key that is equal for filters selecting the same rows: values are deduplicated and
+        sorted, and NAICS prefixes and ranges are replaced with their bounds in sorted columns."""
+        values_keys = tuple(
+            None if values is None else tuple(sorted(set(values)))
+            for values in [states, years, ownership_types]
+        )
+        naics_key = None if naics_prefixes is None else self._naics_bounds(naics_prefixes)
+        range_keys = []
+        for column, (low, high) in sorted((ranges or {}).items()):
+            bounds = self._range_bounds(column, low, high)
+            if bounds is not None:
+                range_keys.append((column, *bounds))
+        return values_keys + (naics_key, tuple(range_keys))
+
+    def _compute_positions(self, filter_key: Tuple) -> np.ndarray:
+        *values_keys, naics_key, range_keys = filter_key
+        bitsets = [
+            self._union_bitset(value_bitsets, values)
+            for value_bitsets, values in zip(
+                [self.state_bitsets, self.year_bitsets, self.ownership_bitsets],
+                values_keys,
+            )
+            if values is not None
+        ]
+        if naics_key is not None:
+            naics_positions = self.naics_codes[1]
+            bitsets.append(self._positions_to_bitset(
+                np.concatenate([naics_positions[start:end] for start, end in naics_key] or [naics_positions[:0]])
+            ))
+        for column, start, end in range_keys:
+            bitsets.append(self._positions_to_bitset(self.sorted_columns[column][1][start:end]))
+        if not bitsets:
+            return np.arange(self.row_count)
+        return np.flatnonzero(np.unpackbits(reduce(np.bitwise_and, bitsets), count=self.row_count))
+
+    def filter_positions(
+        self,
+        states: Optional[Sequence[str]] = None,
+        years: Optional[Sequence[float]] = None,
+        ownership_types: Optional[Sequence[float]] = None,
+        naics_prefixes: Optional[Sequence[str]] = None,
+        ranges: Optional[Dict[str, Sequence[float]]] = None,
+    ) -> np.ndarray:
+        """Returns sorted positions of rows matching all filters. None means that filter is not applied,
+        'naics_prefixes' are codes of any NAICS level (e.g. ['23', '4911']) that codes of rows start with,
+        ranges are inclusive like in 'Series.between'. Returned array is shared between callers and read-only."""
+        filter_key = self._get_filter_key(states, years, ownership_types, naics_prefixes, ranges)
+        # Cache keeps future of every key, so parallel callbacks with the same filters wait for one computation,
+        # while callbacks with other filters aren't blocked by it.
+        with self._cache_lock:
+            future = self._cache.get(filter_key)
+            is_computed_here = future is None
+            if is_computed_here:
+                future = self._cache[filter_key] = Future()
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(filter_key)
+        if not is_computed_here:
+            return future.result()
+        try:
+            positions = self._compute_positions(filter_key)
+            positions.flags.writeable = False
+        except BaseException as error:
+            with self._cache_lock:
+                if self._cache.get(filter_key) is future:
+                    del self._cache[filter_key]
+            future.set_exception(error)
+            raise
+        future.set_result(positions)
+        return positions
+
+    def filter(self, **filters) -> pd.DataFrame:
+        """Returns rows matching filters (see 'filter_positions') taken from dataframe at once."""
+        return self.df.take(self.filter_positions(**filters))
@@ -1,15 +1,18 @@
 """Module contains all functions(with dictionaries for tests) that are used in multiple modules."""
 import os
-import urllib.request
-import urllib.error
 from zipfile import ZipFile
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 from typing import Dict, List
 
-from scrapping_inspection_details import get_case_status
-from constants import INSPECTION_DETAILS_FOLDER_NAME, FOUR_DIGIT_NAICS, TWO_DIGIT_NAICS,\
-    EMPLOYER_NORMALIZED_NAMES, STATE_NAMES, FATALITY_OR_CATASTROPHE_NAMES
+from inspection_downloader import InspectionDownloader
+from inspection_index import CaseStatusIndex
+from name_normalization import get_employer_names_lookup, get_fatality_or_catastrophe_names_lookup
+import constants
+from constants import INSPECTION_DETAILS_FOLDER_NAME
 
 MONEY_TYPE_CONVERSION_TEST_CASES = {
     '$2,892,400.00': 2_892_400.0,
@@ -19,6 +22,9 @@ MONEY_TYPE_CONVERSION_TEST_CASES = {
     '$170.89': 170.89,
     '$0.00': 0.0,
 }
+# Amount without '$' and thousands separators, with whole cents at most
+MONEY_NUMBER_PATTERN = r'^-?\d+(\.\d{1,2})?$'
+PENALTY_COLUMNS = ['total_initial_penalty', 'total_current_penalty', 'total_fta_penalty']
 
 
 def money_string_to_number(money_string: str) -> float:
@@ -31,17 +37,76 @@ def money_number_to_string(money_number: float) -> str:
     return f"${money_number:,.2f}"
 
 
+def money_strings_to_cents(money_strings: pd.Series) -> pd.Series:
+    """Vectorized 'money_string_to_number' returning integer cents, e.g. '$2,892,400.00' -> 289240000.
+    Missing values, empty strings (NULL_STRING), strings that aren't amounts and amounts with fractions of cents
+    (e.g. '$12.345', which can't be stored exactly) are converted to <NA>."""
+    strings = pa.array(money_strings.astype('string[pyarrow]'), type=pa.large_string())
+    # Trimming and literal replacement are much faster than regular expression replacement
+    numbers = pc.replace_substring(pc.utf8_ltrim(strings, '$'), ',', '')
+    numbers = pc.if_else(pc.match_substring_regex(numbers, MONEY_NUMBER_PATTERN), numbers, None)
+    # Float64 represents cents exactly up to 2 ** 53, so rounding removes only representation errors
+    cents = pc.round(pc.multiply(pc.cast(numbers, pa.float64()), 100))
+    # pd.array(..., dtype='Int64') goes through Python objects, so values and missing values mask are taken apart
+    cents = pc.cast(cents, pa.int64())
+    mask = pc.is_null(cents).to_numpy(zero_copy_only=False)
+    cents = pd.arrays.IntegerArray(pc.fill_null(cents, 0).to_numpy(), mask)
+    return pd.Series(cents, index=money_strings.index, name=money_strings.name)
+
+
+def cents_to_money_strings(cents: pd.Series) -> pd.Series:
+    """Vectorized 'money_number_to_string' for integer cents, e.g. 289240000 -> '$2,892,400.00'.
+    Every distinct amount is formatted only once, missing values are kept."""
+    codes, uniques = pd.factorize(cents)
+    # The last item is taken by code -1 of missing values
+    money_strings = np.array([money_number_to_string(amount / 100) for amount in uniques] + [None], dtype=object)
+    return pd.Series(money_strings[codes], index=cents.index, name=cents.name, dtype='string')
+
+
+def get_money_conversion_errors() -> Dict[str, float]:
+    """Converts MONEY_TYPE_CONVERSION_TEST_CASES with vectorized functions and returns cases that differ."""
+    money_strings = pd.Series(list(MONEY_TYPE_CONVERSION_TEST_CASES))
+    cents = money_strings_to_cents(money_strings)
+    formatted = cents_to_money_strings(cents)
+    return {
+        money_string: amount / 100
+        for money_string, amount, formatted_string in zip(money_strings, cents, formatted)
+        if amount != round(MONEY_TYPE_CONVERSION_TEST_CASES[money_string] * 100) or formatted_string != money_string
+    }
+
+
+def penalties_to_cents(inspections: pd.DataFrame) -> pd.DataFrame:
+    """Returns dataframe of 'parse_inspection_files' with penalty columns converted to integer cents."""
+    return inspections.assign(**{
+        column: money_strings_to_cents(inspections[column]) for column in PENALTY_COLUMNS if column in inspections
+    })
+
+
 def mapping_employer_names(employer_name: str) -> str:
-    """Unifies companies names to enable grouping operations."""
-    for unified_name, old_names_list in EMPLOYER_NORMALIZED_NAMES.items():
+    """Unifies companies names to enable grouping operations.
+    For columns 'name_normalization.normalize_employer_names' is much faster than apply."""
+    return get_employer_names_lookup().get(employer_name, employer_name)
+
+
+def unification_of_fatalities(fatality_or_catastrophe_name: str) -> str:
+    """Unifies fatality / catastrophe names in column to enable grouping operations.
+    For columns 'name_normalization.normalize_fatality_or_catastrophe_names' is much faster than apply."""
+    return get_fatality_or_catastrophe_names_lookup().get(fatality_or_catastrophe_name, fatality_or_catastrophe_name)
+
+
+def _mapping_employer_names_linear(employer_name: str) -> str:
+    """Original 'mapping_employer_names' which searches all lists, kept as baseline of
+    'name_normalization.benchmark_normalization'."""
+    for unified_name, old_names_list in constants.EMPLOYER_NORMALIZED_NAMES.items():
         if employer_name in old_names_list:
             return unified_name
     return employer_name
 
 
-def unification_of_fatalities(fatality_or_catastrophe_name: str) -> str:
-    """Unifies fatality / catastrophe names in column to enable grouping operations."""
-    for unified_name, old_names_list in FATALITY_OR_CATASTROPHE_NAMES.items():
+def _unification_of_fatalities_linear(fatality_or_catastrophe_name: str) -> str:
+    """Original 'unification_of_fatalities' which searches all lists, kept as baseline of
+    'name_normalization.benchmark_normalization'."""
+    for unified_name, old_names_list in constants.FATALITY_OR_CATASTROPHE_NAMES.items():
         if fatality_or_catastrophe_name in old_names_list:
             return unified_name
     return fatality_or_catastrophe_name
@@ -49,14 +114,14 @@ def unification_of_fatalities(fatality_or_catastrophe_name: str) -> str:
 
 def get_long_us_state_name_from_abbreviation(abbreviation: str) -> str:
     """Unifies companies names to enable grouping operations."""
-    return STATE_NAMES[abbreviation] if abbreviation in STATE_NAMES.keys() else abbreviation
+    return constants.STATE_NAMES.get(abbreviation, abbreviation)
 
 
 def get_naics_sector_numbers_by_names(naics_sector_names: List[str]) -> List[str]:
     """Get NAICS sector numbers by their names from 'TWO_DIGIT_NAICS.json'"""
     my_set = set()
     for naics_sector_name in naics_sector_names:
-        my_set.update([key for key, value in TWO_DIGIT_NAICS.items() if value == naics_sector_name])
+        my_set.update([key for key, value in constants.TWO_DIGIT_NAICS.items() if value == naics_sector_name])
     return list(my_set)
 
 
@@ -96,22 +161,23 @@ def print_cumulative_sum_for_column(column) -> None:
 
 
 def parse_two_digit_naics_code(naics_code: str) -> str:
-    """Returns sector name."""
-    return TWO_DIGIT_NAICS[naics_code[:2]] if pd.notna(naics_code) else 'Non-classifiable'
+    """Returns sector name. For columns 'naics_codes.get_sector_labels' is much faster than apply."""
+    return constants.TWO_DIGIT_NAICS[naics_code[:2]] if pd.notna(naics_code) else 'Non-classifiable'
 
 
 def parse_four_digit_naics_code(naics_code: str) -> str:
     """Returns name of industry group if it's code is in 'FOUR_DIGIT_NAICS.json' file.
-    Otherwise, returns sector name."""
+    Otherwise, returns sector name. For columns 'naics_codes.get_industry_group_labels' is much faster than apply."""
     if pd.notna(naics_code):
-        return FOUR_DIGIT_NAICS[naics_code[:4]]\
-            if naics_code[:4] in FOUR_DIGIT_NAICS.keys()\
-            else 'Other ' + TWO_DIGIT_NAICS[naics_code[:2]]
+        return constants.FOUR_DIGIT_NAICS[naics_code[:4]]\
+            if naics_code[:4] in constants.FOUR_DIGIT_NAICS.keys()\
+            else 'Other ' + constants.TWO_DIGIT_NAICS[naics_code[:2]]
     return 'Non-classifiable'
 
 
 def concat_zipped_csv_files(path, **kwargs) -> pd.DataFrame:
-    """Returns dataframe with concatenated CSV files in archive."""
+    """Returns dataframe with concatenated CSV files in archive.
+    For archives that don't fit in memory use 'zipped_csv.write_zipped_csv_to_parquet'."""
     zip_file = ZipFile(path, mode="r")
     return pd.concat([
         pd.read_csv(zip_file.open(text_file.filename), **kwargs)
@@ -120,39 +186,29 @@ def concat_zipped_csv_files(path, **kwargs) -> pd.DataFrame:
     ], ignore_index=True)
 
 
-def download_inspection_files(inspection_numbers: List[float]) -> List[float]:
-    """Downloads **Inspection Details** files to folder by adding inspection_number to URL.
-    Returns list of numbers that failed to download. \n
+def download_inspection_files(inspection_numbers: List[float], **downloader_kwargs) -> List[float]:
+    """Downloads **Inspection Details** pages to folder or archive by adding inspection_number to URL.
+    Files are downloaded concurrently, and interrupted download is resumed when called again with the same numbers
+    (see 'InspectionDownloader' for 'downloader_kwargs'). Returns list of numbers that failed to download. \n
     Example: https://www.osha.gov/ords/imis/establishment.inspection_detail?id=1595777.015 \n
     Definitions: https://www.osha.gov/data/inspection-detail-definitions#tab1
     """
-    if not os.path.exists(INSPECTION_DETAILS_FOLDER_NAME):
-        os.makedirs(INSPECTION_DETAILS_FOLDER_NAME)
-    failed_numbers = []
-    for index, number in enumerate(inspection_numbers):
-        try:
-            urllib.request.urlretrieve(
-                url=f'https://www.osha.gov/ords/imis/establishment.inspection_detail?id={number}',
-                filename=f'{INSPECTION_DETAILS_FOLDER_NAME}/{number}.html'
-            )
-        except (urllib.error.URLError, urllib.error.HTTPError, KeyboardInterrupt) as error:
-            failed_numbers.append(number)
-            print(f'{index}: {number} was failed to download: {error}')
-        else:
-            print(f'{index}: {number} was downloaded successfully')
-    return failed_numbers
+    return InspectionDownloader(**downloader_kwargs).download(inspection_numbers)
 
 
 def download_open_cases_again(path_to_files: str) -> List[float]:
-    """Downloads files with 'Open' or absent case statuses, and returns their numbers"""
+    """Downloads files with 'Open' or absent case statuses, and returns their numbers.
+    Statuses are taken from 'CaseStatusIndex', which parses only new or changed files."""
     print("Detecting which files contain 'OPEN' or absent case statuses...")
-    inspection_file_names = list(filter(
-        lambda file_name: get_case_status(f'{path_to_files}/{file_name}') != 'CLOSED',
-        os.listdir(path_to_files)
-    ))
-    print("Removing '.html' extension from file names...")
-    open_inspection_numbers = list(map(lambda file_name: file_name[:-5], inspection_file_names))
-    print(f"Downloading {len(open_inspection_numbers)} files...")
-    failed_numbers = download_inspection_files(open_inspection_numbers)
+    case_status_index = CaseStatusIndex(path_to_files)
+    try:
+        case_status_index.sync()
+        open_inspection_numbers = case_status_index.get_numbers_with_status_other_than('CLOSED')
+        print(f"Downloading {len(open_inspection_numbers)} files...")
+        failed_numbers = download_inspection_files(
+            open_inspection_numbers, location=path_to_files, on_saved=case_status_index.update
+        )
+    finally:
+        case_status_index.close()
     return open_inspection_numbers, failed_numbers
 
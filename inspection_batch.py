@@ -0,0 +1,163 @@
+"""Module for compact column storage of many parsed inspections. Instead of one Inspection object per page, every
+field is a single array: integers are NumPy arrays, penalties are integer cents, texts are categoricals, and Literal
+fields are small integer codes which mean the same values in every batch."""
+from dataclasses import dataclass, fields
+from typing import Dict, Iterable, Iterator, List, Literal, Tuple, Union, get_args, get_origin
+
+import numpy as np
+import pandas as pd
+
+from constants import NULL_INT, NULL_STRING
+from helpers import PENALTY_COLUMNS, money_number_to_string, money_strings_to_cents
+from scrapping_inspection_details import INSPECTION_DTYPES, Inspection
+
+INSPECTION_INT_DTYPE = np.int32  # NAICS codes have 6 digits, numbers of violations are small
+PENALTY_DTYPE = np.int64  # Cents of the largest penalties don't fit int32
+# Field name: allowed values of Literal field, their positions are codes
+LITERAL_VALUES: Dict[str, Tuple[str, ...]] = {
+    field.name: get_args(field.type) for field in fields(Inspection) if get_origin(field.type) is Literal
+}
+
+Column = Union[np.ndarray, pd.Categorical]
+
+
+def _to_categorical(values: Iterable, name: str) -> pd.Categorical:
+    """Returns categorical of values where NULL_STRING and missing values are missing. Literal fields have
+    LITERAL_VALUES as the first categories, values absent in them (e.g. new inspection types) follow in sorted order
+    so that nothing is lost."""
+    categorical = pd.Categorical(pd.Series(values, dtype=object))
+    known_values = list(LITERAL_VALUES.get(name, ()))
+    other_values = [value for value in categorical.categories if value != NULL_STRING and value not in known_values]
+    return categorical.set_categories(known_values + other_values)
+
+
+def _to_cents(values: Iterable) -> np.ndarray:
+    """Returns cents of penalty strings (see 'helpers.money_strings_to_cents'), NULL_INT for missing values,
+    NULL_STRING and strings that aren't amounts."""
+    money_strings = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype=object)
+    return money_strings_to_cents(money_strings).to_numpy(dtype=PENALTY_DTYPE, na_value=NULL_INT)
+
+
+def _format_cents(cents: int) -> str:
+    """Returns penalty string like on pages: whole dollars without cents (e.g. '$533,468'), otherwise with them."""
+    if cents == NULL_INT:
+        return NULL_STRING
+    dollars, rest = divmod(int(cents), 100)
+    return f'${dollars:,}' if not rest else money_number_to_string(cents / 100)
+
+
+def _to_money_strings(cents: np.ndarray) -> List[str]:
+    """Returns penalty strings of cents, every distinct amount is formatted once."""
+    amounts, positions = np.unique(cents, return_inverse=True)
+    money_strings = np.array([_format_cents(amount) for amount in amounts], dtype=object)
+    return money_strings[positions.reshape(-1)].tolist()
+
+
+def _to_integers(values: Iterable) -> np.ndarray:
+    """Returns integer array where missing values are NULL_INT."""
+    return pd.array(list(values) if not isinstance(values, pd.Series) else values, dtype='Int64') \
+        .to_numpy(dtype=INSPECTION_INT_DTYPE, na_value=NULL_INT)
+
+
+@dataclass(frozen=True, eq=False)
+class InspectionBatch:
+    """Struct of arrays with one column per Inspection field, all of the same length. Integer fields keep
+    NULL_INT like Inspection does, missing texts are missing values of categoricals and are NULL_STRING again
+    in 'to_inspections'. Penalties (PENALTY_COLUMNS) are int64 cents with NULL_INT for missing amounts, they are
+    formatted again when inspections are returned, so e.g. '$100.00' becomes '$100' and strings that aren't
+    amounts become NULL_STRING. Batches are compared by values of columns and aren't hashable."""
+    columns: Dict[str, Column]
+    __slots__ = ('columns',)
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, Iterable]) -> 'InspectionBatch':
+        """Builds batch from values of every Inspection field, e.g. columns of 'parse_inspection_files' dataframe.
+        Missing values are allowed in all fields."""
+        return cls({
+            field.name: (
+                _to_integers(columns[field.name]) if field.type is int
+                else _to_cents(columns[field.name]) if field.name in PENALTY_COLUMNS
+                else _to_categorical(columns[field.name], field.name)
+            )
+            for field in fields(Inspection)
+        })
+
+    @classmethod
+    def from_inspections(cls, inspections: Iterable[Inspection]) -> 'InspectionBatch':
+        field_names = [field.name for field in fields(Inspection)]
+        rows = [[getattr(inspection, name) for name in field_names] for inspection in inspections]
+        columns = zip(*rows) if rows else [[] for _ in field_names]
+        return cls.from_columns(dict(zip(field_names, columns)))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'InspectionBatch':
+        """Builds batch from dataframe with Inspection fields (other columns are ignored), see 'to_frame'."""
+        return cls.from_columns({field.name: df[field.name].astype(object) for field in fields(Inspection)})
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, position: int) -> Inspection:
+        values = {}
+        for name, column in self.columns.items():
+            value = column[position]
+            if isinstance(column, pd.Categorical):
+                values[name] = NULL_STRING if pd.isna(value) else value
+            elif name in PENALTY_COLUMNS:
+                values[name] = _format_cents(value)
+            else:
+                values[name] = int(value)
+        return Inspection(**values)
+
+    def __iter__(self) -> Iterator[Inspection]:
+        return iter(self.to_inspections())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, InspectionBatch) or len(self) != len(other):
+            return False
+        return all(
+            column.equals(other.columns[name]) if isinstance(column, pd.Categorical)
+            else np.array_equal(column, other.columns[name])
+            for name, column in self.columns.items()
+        )
+
+    __hash__ = None
+
+    def get_codes(self, name: str) -> np.ndarray:
+        """Returns small integer codes of text field, -1 for missing values. Codes of Literal fields are positions
+        in LITERAL_VALUES, e.g. to compare them without strings."""
+        return self.columns[name].codes
+
+    def to_inspections(self) -> List[Inspection]:
+        columns = {}
+        for name, column in self.columns.items():
+            if isinstance(column, pd.Categorical):
+                # The last item is taken by code -1 of missing values
+                values = np.append(column.categories.to_numpy(dtype=object), NULL_STRING)
+                columns[name] = values[column.codes].tolist()
+            elif name in PENALTY_COLUMNS:
+                columns[name] = _to_money_strings(column)
+            else:
+                columns[name] = column.tolist()
+        return [Inspection(*values) for values in zip(*columns.values())]
+
+    def to_frame(self) -> pd.DataFrame:
+        """Returns dataframe with INSPECTION_DTYPES, like 'scrapping_inspection_details.inspections_to_frame':
+        NULL_INT and NULL_STRING are missing values. Literal fields keep all LITERAL_VALUES as categories,
+        penalties are formatted strings (see 'helpers.penalties_to_cents' to get cents)."""
+        df = pd.DataFrame(index=pd.RangeIndex(len(self)))
+        for name, column in self.columns.items():
+            if isinstance(column, pd.Categorical):
+                df[name] = pd.Series(column).astype(INSPECTION_DTYPES[name])
+            elif name in PENALTY_COLUMNS:
+                df[name] = pd.array(_to_money_strings(column), dtype=INSPECTION_DTYPES[name])
+                df[name] = df[name].mask(column == NULL_INT)
+            else:
+                df[name] = pd.array(column, dtype=INSPECTION_DTYPES[name])
+                df[name] = df[name].mask(column == NULL_INT)
+        return df
+
+    def get_memory_usage(self) -> int:
+        """Returns number of bytes taken by columns, including categories."""
+        return sum(column.nbytes if isinstance(column, np.ndarray) else column.memory_usage(deep=True)
+                   for column in self.columns.values())
@@ -0,0 +1,240 @@
+"""Module for concurrent downloading of **Inspection Details** pages. Downloads can be interrupted and resumed.
+Definitions: https://www.osha.gov/data/inspection-detail-definitions#tab1
+"""
+import hashlib
+import http.client
+import os
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from constants import INSPECTION_DETAILS_FOLDER_NAME
+from inspection_storage import get_inspection_storage
+
+INSPECTION_DETAILS_URL = 'https://www.osha.gov/ords/imis/establishment.inspection_detail?id={number}'
+USER_AGENT = 'Mozilla/5.0 (compatible; Moby)'
+PROGRESS_REPORT_INTERVAL = 100  # Number of processed files between progress messages
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+class HTTPStatusError(Exception):
+    """Response with status other than 200."""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f'HTTP status {status}')
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def is_retryable(self) -> bool:
+        return self.status == 429 or self.status >= 500
+
+
+class RateLimiter:
+    """Spaces requests evenly, so that there are at most 'requests_per_second' of them. Shared by threads."""
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(self.next_time, now)
+            self.next_time = request_time + self.interval
+        time.sleep(max(request_time - now, 0))
+
+
+class InspectionDownloader:
+    """Downloads **Inspection Details** pages to folder or archive (see 'inspection_storage') with at most 'max_workers' parallel requests and at most
+    'requests_per_second' requests per host. Every thread keeps its connection to host open between requests.
+    Failed requests (network errors, statuses 429 and 5xx) are retried after exponentially growing delays.
+    Redirects are followed, at most MAX_REDIRECTS of them per page. Connections are closed when 'download' returns.
+    Downloaded numbers are appended to journal file, and if the same list of numbers is downloaded again after
+    interruption, numbers from journal are skipped. Journal is removed when all files are downloaded.
+    'on_saved' is called with inspection number and content after every written page (e.g. to index it)."""
+
+    def __init__(
+            self,
+            location: str = INSPECTION_DETAILS_FOLDER_NAME,
+            url_template: str = INSPECTION_DETAILS_URL,
+            max_workers: int = 8,
+            requests_per_second: float = 4.0,
+            max_retries: int = 4,
+            backoff_factor: float = 1.0,
+            timeout: float = 30.0,
+            journal_path: Optional[str] = None,
+            on_saved: Optional[Callable[[object, bytes], None]] = None,
+    ):
+        self.storage = get_inspection_storage(location)
+        self.url_template = url_template
+        self.max_workers = max_workers
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.journal_path = journal_path or f'{location}_download_journal.txt'
+        self.on_saved = on_saved
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+        self._rate_limiters_lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: Set[http.client.HTTPConnection] = set()
+        self._connections_lock = threading.Lock()
+
+    def _get_rate_limiter(self, host: str) -> RateLimiter:
+        with self._rate_limiters_lock:
+            if host not in self._rate_limiters:
+                self._rate_limiters[host] = RateLimiter(self.requests_per_second)
+            return self._rate_limiters[host]
+
+    def _get_connection(self, scheme: str, host: str) -> http.client.HTTPConnection:
+        """Returns connection of current thread to host, it is created on the first request."""
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        if (scheme, host) not in self._local.connections:
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            connection = connection_class(host, timeout=self.timeout)
+            self._local.connections[(scheme, host)] = connection
+            with self._connections_lock:
+                self._connections.add(connection)
+        return self._local.connections[(scheme, host)]
+
+    def _close_connection(self, scheme: str, host: str) -> None:
+        connection = getattr(self._local, 'connections', {}).pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+            with self._connections_lock:
+                self._connections.discard(connection)
+
+    def close(self) -> None:
+        """Closes connections of all threads. Threads open new ones if downloader is used again."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, set()
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def fetch(self, url: str) -> bytes:
+        """Returns body of response to GET request, raises HTTPStatusError if status isn't 200.
+        Redirects are followed like by 'urllib.request'."""
+        for _ in range(MAX_REDIRECTS + 1):
+            response, body = self._request(url)
+            location = response.getheader('Location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                break
+            url = urllib.parse.urljoin(url, location)
+        if response.status != 200:
+            retry_after = response.getheader('Retry-After')
+            raise HTTPStatusError(
+                response.status, float(retry_after) if retry_after and retry_after.isdigit() else None
+            )
+        return body
+
+    def _request(self, url: str) -> Tuple[http.client.HTTPResponse, bytes]:
+        """Sends GET request with connection of current thread and returns response with its body."""
+        parsed_url = urllib.parse.urlsplit(url)
+        path = f'{parsed_url.path}?{parsed_url.query}' if parsed_url.query else parsed_url.path
+        self._get_rate_limiter(parsed_url.netloc).wait()
+        connection = self._get_connection(parsed_url.scheme, parsed_url.netloc)
+        try:
+            connection.request('GET', path, headers={'User-Agent': USER_AGENT})
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            # Connection could be closed by server, the next request will open a new one
+            self._close_connection(parsed_url.scheme, parsed_url.netloc)
+            raise
+        if response.will_close:
+            self._close_connection(parsed_url.scheme, parsed_url.netloc)
+        return response, body
+
+    def fetch_with_retries(self, url: str) -> bytes:
+        """Fetches URL, retrying after 'backoff_factor' * 2 ** attempt seconds (with jitter) on retryable errors."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.fetch(url)
+            except HTTPStatusError as error:
+                if not error.is_retryable or attempt == self.max_retries:
+                    raise
+                delay = max(error.retry_after or 0, self.backoff_factor * 2 ** attempt)
+            except (http.client.HTTPException, OSError):
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff_factor * 2 ** attempt
+            time.sleep(delay * random.uniform(1, 1.5))
+
+    def save(self, number, content: bytes) -> None:
+        """Writes page of inspection to storage."""
+        self.storage.write(number, content)
+        if self.on_saved is not None:
+            self.on_saved(number, content)
+
+    def download_one(self, number) -> None:
+        self.save(number, self.fetch_with_retries(self.url_template.format(number=number)))
+
+    @staticmethod
+    def _get_run_id(inspection_numbers: Iterable) -> str:
+        return hashlib.sha1('\n'.join(map(str, inspection_numbers)).encode('utf-8')).hexdigest()
+
+    def _read_journal(self, run_id: str) -> Set[str]:
+        """Returns numbers that were downloaded in interrupted run with the same numbers."""
+        if not os.path.exists(self.journal_path):
+            return set()
+        with open(self.journal_path, 'r', encoding='utf-8') as journal:
+            lines = journal.read().splitlines()
+        if not lines or lines[0] != f'# run {run_id}':
+            return set()
+        return set(lines[1:])
+
+    def _start_journal(self, run_id: str, resume: bool) -> None:
+        if resume and os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'w', encoding='utf-8') as journal:
+            journal.write(f'# run {run_id}\n')
+
+    def _write_journal(self, number) -> None:
+        with self._journal_lock, open(self.journal_path, 'a', encoding='utf-8') as journal:
+            journal.write(f'{number}\n')
+
+    def download(self, inspection_numbers: List, resume: bool = True) -> List:
+        """Downloads pages and returns list of numbers that failed to download."""
+        run_id = self._get_run_id(inspection_numbers)
+        downloaded_numbers = self._read_journal(run_id) if resume else set()
+        self._start_journal(run_id, resume=bool(downloaded_numbers))
+        numbers_to_download = [number for number in inspection_numbers if str(number) not in downloaded_numbers]
+        print(f'Downloading {len(numbers_to_download)} files ({len(downloaded_numbers)} were downloaded before)...')
+
+        failed_numbers = []
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        # Pending downloads are cancelled and connections are closed on any exception, not only on interruption
+        try:
+            futures = {executor.submit(self.download_one, number): number for number in numbers_to_download}
+            for index, future in enumerate(as_completed(futures), start=1):
+                number = futures[future]
+                try:
+                    future.result()
+                except (HTTPStatusError, http.client.HTTPException, OSError) as error:
+                    failed_numbers.append(number)
+                    print(f'{number} was failed to download: {error}')
+                else:
+                    self._write_journal(number)
+                if index % PROGRESS_REPORT_INTERVAL == 0:
+                    print(f'{index} of {len(numbers_to_download)} files are processed')
+        except KeyboardInterrupt:
+            print('Download was interrupted, run it again with the same numbers to resume')
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.close()
+
+        if not failed_numbers:
+            os.remove(self.journal_path)
+        print(f'{len(numbers_to_download) - len(failed_numbers)} files were downloaded, '
+              f'{len(failed_numbers)} failed')
+        return failed_numbers
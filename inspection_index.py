@@ -0,0 +1,246 @@
+"""Module for persistent SQLite indexes of **Inspection Details** pages, so that the whole folder or archive
+isn't parsed every time case statuses or parsed inspections are needed."""
+import hashlib
+import os
+import sqlite3
+import threading
+from dataclasses import astuple, fields
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from constants import INSPECTION_DETAILS_FOLDER_NAME
+from inspection_storage import ARCHIVE_EXTENSION, get_inspection_storage
+from scrapping_inspection_details import (
+    Inspection,
+    inspections_to_frame,
+    parse_case_status,
+    parse_inspection_content,
+    parse_inspection_results,
+)
+
+INSPECTION_FIELD_NAMES = [field.name for field in fields(Inspection)]
+
+
+def get_index_path(location: str) -> str:
+    """Index is stored next to folder or archive, so that it isn't listed among inspection pages."""
+    if location.endswith(ARCHIVE_EXTENSION):
+        return f'{location[:-len(ARCHIVE_EXTENSION)]}_archive_index.sqlite'
+    return f'{location}_index.sqlite'
+
+
+class CaseStatusIndex:
+    """Keeps inspection number, case status, version (see 'inspection_storage') and content hash of every page in
+    folder or archive. Index is updated when downloaded pages are written (see 'update') and by 'sync', which
+    parses only pages that are new or were changed since they were indexed. Can be used from multiple threads."""
+
+    def __init__(self, location: str = INSPECTION_DETAILS_FOLDER_NAME, index_path: Optional[str] = None):
+        self.storage = get_inspection_storage(location)
+        if not self.storage.exists():
+            # Otherwise mistyped location would get an empty index next to it
+            raise FileNotFoundError(f'No inspection folder or archive {location}')
+        self.connection = sqlite3.connect(index_path or get_index_path(location), timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS case_statuses ('
+                'inspection_number TEXT PRIMARY KEY, case_status TEXT NOT NULL, '
+                'version INTEGER NOT NULL, content_hash TEXT NOT NULL)'
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS case_statuses_by_status ON case_statuses (case_status)'
+            )
+
+    def update(self, inspection_number, content: bytes) -> None:
+        """Indexes written page with content. Status isn't parsed again if content didn't change."""
+        content_hash = hashlib.sha1(content).hexdigest()
+        version = self.storage.get_version(inspection_number)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT case_status, content_hash FROM case_statuses WHERE inspection_number = ?',
+                (str(inspection_number),),
+            ).fetchone()
+        case_status = row[0] if row and row[1] == content_hash else parse_case_status(content)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO case_statuses VALUES (?, ?, ?, ?)',
+                (str(inspection_number), case_status, version, content_hash),
+            )
+
+    def sync(self) -> None:
+        """Indexes pages which are new or changed since they were indexed, removes pages which don't exist."""
+        with self.lock:
+            indexed_versions = dict(self.connection.execute('SELECT inspection_number, version FROM case_statuses'))
+        versions = self.storage.get_versions()
+        for inspection_number, version in versions.items():
+            if indexed_versions.get(inspection_number) != version:
+                self.update(inspection_number, self.storage.read(inspection_number))
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'DELETE FROM case_statuses WHERE inspection_number = ?',
+                [(number,) for number in indexed_versions.keys() - versions.keys()],
+            )
+
+    def get_numbers_with_status_other_than(self, case_status: str) -> List[str]:
+        """Returns inspection numbers of pages with other or absent case status."""
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                'SELECT inspection_number FROM case_statuses WHERE case_status != ? ORDER BY inspection_number',
+                (case_status,),
+            )]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class ParsedInspectionStore:
+    """Keeps parsed Inspection of every page with version of page and its content hash. Pages are parsed again
+    only if their content changed, so 'refresh' takes time proportional to the number of changed pages.
+    Error of page that can't be parsed is kept the same way, so unchanged broken pages aren't parsed again.
+    Stored in the same SQLite file as 'CaseStatusIndex'. Can be used from multiple threads."""
+
+    def __init__(self, location: str = INSPECTION_DETAILS_FOLDER_NAME, index_path: Optional[str] = None):
+        self.location = location
+        self.storage = get_inspection_storage(location)
+        if not self.storage.exists():
+            # Otherwise mistyped location would get an empty index next to it
+            raise FileNotFoundError(f'No inspection folder or archive {location}')
+        self.connection = sqlite3.connect(index_path or get_index_path(location), timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS parsed_inspections ('
+                'inspection_number TEXT PRIMARY KEY, version INTEGER NOT NULL, content_hash TEXT NOT NULL, '
+                + ', '.join(INSPECTION_FIELD_NAMES) + ')'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS inspection_parse_errors ('
+                'inspection_number TEXT PRIMARY KEY, version INTEGER NOT NULL, content_hash TEXT NOT NULL, '
+                'error TEXT NOT NULL)'
+            )
+
+    def _get_row(self, inspection_number: str) -> Optional[tuple]:
+        with self.lock:
+            return self.connection.execute(
+                'SELECT version, content_hash, ' + ', '.join(INSPECTION_FIELD_NAMES) +
+                ' FROM parsed_inspections WHERE inspection_number = ?',
+                (inspection_number,),
+            ).fetchone()
+
+    def _save(self, inspection_number: str, version: int, content_hash: str, values: tuple) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO parsed_inspections VALUES (' + ', '.join('?' * (len(values) + 3)) + ')',
+                (inspection_number, version, content_hash, *values),
+            )
+            self.connection.execute('DELETE FROM inspection_parse_errors WHERE inspection_number = ?',
+                                    (inspection_number,))
+
+    def _save_error(self, inspection_number: str, version: int, content_hash: str, error: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO inspection_parse_errors VALUES (?, ?, ?, ?)',
+                (inspection_number, version, content_hash, error),
+            )
+            # Page which was parsed before isn't returned with its old values anymore
+            self.connection.execute('DELETE FROM parsed_inspections WHERE inspection_number = ?',
+                                    (inspection_number,))
+
+    def _update_version(self, inspection_number: str, version: int) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE parsed_inspections SET version = ? WHERE inspection_number = ?',
+                (version, inspection_number),
+            )
+
+    def get(self, inspection_number) -> Inspection:
+        """Returns stored Inspection if page didn't change, otherwise parses page and stores the result."""
+        inspection_number = str(inspection_number)
+        version = self.storage.get_version(inspection_number)
+        row = self._get_row(inspection_number)
+        if row is not None and row[0] == version:
+            return Inspection(*row[2:])
+        content = self.storage.read(inspection_number)
+        content_hash = hashlib.sha1(content).hexdigest()
+        if row is not None and row[1] == content_hash:
+            self._update_version(inspection_number, version)
+            return Inspection(*row[2:])
+        inspection = parse_inspection_content(content)
+        self._save(inspection_number, version, content_hash, astuple(inspection))
+        return inspection
+
+    def refresh(self, processes: Optional[int] = None) -> Dict[str, str]:
+        """Parses new and changed pages in pool of processes and removes pages which don't exist.
+        Returns error messages of pages that can't be parsed, including unchanged pages that failed before."""
+        with self.lock:
+            stored = {
+                number: (version, content_hash) for number, version, content_hash in
+                self.connection.execute('SELECT inspection_number, version, content_hash FROM parsed_inspections')
+            }
+            stored_errors = {
+                number: (version, content_hash, error) for number, version, content_hash, error in
+                self.connection.execute('SELECT inspection_number, version, content_hash, error '
+                                        'FROM inspection_parse_errors')
+            }
+        versions = self.storage.get_versions()
+        changed_pages, errors = {}, {}
+        for inspection_number, version in versions.items():
+            stored_version, stored_content_hash = stored.get(inspection_number, (None, None))
+            error_version, error_content_hash, error = stored_errors.get(inspection_number, (None, None, None))
+            if stored_version == version:
+                continue
+            if error_version == version:
+                errors[inspection_number] = error
+                continue
+            content_hash = hashlib.sha1(self.storage.read(inspection_number)).hexdigest()
+            if stored_content_hash == content_hash:
+                self._update_version(inspection_number, version)
+            elif error_content_hash == content_hash:
+                self._save_error(inspection_number, version, content_hash, error)
+                errors[inspection_number] = error
+            else:
+                changed_pages[inspection_number] = (version, content_hash)
+
+        failed_count = 0
+        if changed_pages:
+            for inspection_number, values, error in parse_inspection_results(list(changed_pages), self.location,
+                                                                              processes):
+                if error is not None:
+                    self._save_error(inspection_number, *changed_pages[inspection_number], error)
+                    errors[inspection_number] = error
+                    failed_count += 1
+                else:
+                    self._save(inspection_number, *changed_pages[inspection_number], values)
+        with self.lock, self.connection:
+            for table, numbers in [('parsed_inspections', stored.keys()), ('inspection_parse_errors', stored_errors)]:
+                self.connection.executemany(
+                    f'DELETE FROM {table} WHERE inspection_number = ?',
+                    [(number,) for number in numbers - versions.keys()],
+                )
+        print(f'{len(changed_pages) - failed_count} pages were parsed, {failed_count} failed, '
+              f'{len(versions) - len(changed_pages)} were unchanged '
+              f'({len(errors) - failed_count} of them can\'t be parsed)')
+        return errors
+
+    def to_frame(self) -> pd.DataFrame:
+        """Returns all stored inspections as dataframe (see 'inspections_to_frame')."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT inspection_number, ' + ', '.join(INSPECTION_FIELD_NAMES) +
+                ' FROM parsed_inspections ORDER BY inspection_number'
+            ).fetchall()
+        return inspections_to_frame([(row[0], row[1:], None) for row in rows])
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+@lru_cache(maxsize=None)
+def _get_process_parsed_inspection_store(location: str, process_id: int) -> ParsedInspectionStore:
+    return ParsedInspectionStore(location)
+
+
+def get_parsed_inspection_store(location: str = INSPECTION_DETAILS_FOLDER_NAME) -> ParsedInspectionStore:
+    """Returns store of folder or archive that is shared within process (see 'get_inspection_storage')."""
+    return _get_process_parsed_inspection_store(location, os.getpid())
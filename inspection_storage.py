@@ -0,0 +1,179 @@
+"""Module for storing downloaded **Inspection Details** pages either as separate files in folder or compressed in
+single archive file, which doesn't cost an inode per page. Location ending with ARCHIVE_EXTENSION is an archive."""
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from constants import INSPECTION_DETAILS_FOLDER_NAME
+
+ARCHIVE_EXTENSION = '.sqlite'
+COMPRESSION_LEVEL = 6
+COPY_BATCH_SIZE = 1000
+
+
+class InspectionFolder:
+    """Stores every page as '{inspection_number}.html' file. Version of page is modification time of its file.
+    Folder is created by the first write, reading from folder that doesn't exist raises FileNotFoundError."""
+
+    def __init__(self, folder: str = INSPECTION_DETAILS_FOLDER_NAME):
+        self.location = folder
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.location)
+
+    def get_path(self, inspection_number) -> str:
+        return f'{self.location}/{inspection_number}.html'
+
+    def read(self, inspection_number) -> bytes:
+        with open(self.get_path(inspection_number), 'rb') as file:
+            return file.read()
+
+    def write(self, inspection_number, content: bytes) -> None:
+        """Temporary file is renamed, so that interrupted writes leave no broken files."""
+        os.makedirs(self.location, exist_ok=True)
+        path = self.get_path(inspection_number)
+        temporary_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(content)
+        os.replace(temporary_path, path)
+
+    def write_many(self, pages: Iterable[Tuple[str, bytes]]) -> None:
+        for inspection_number, content in pages:
+            self.write(inspection_number, content)
+
+    def get_version(self, inspection_number) -> int:
+        return os.stat(self.get_path(inspection_number)).st_mtime_ns
+
+    def get_versions(self) -> Dict[str, int]:
+        """Returns versions of all pages by their inspection numbers."""
+        versions = {}
+        with os.scandir(self.location) as entries:
+            for entry in entries:
+                if entry.name.endswith('.html'):
+                    versions[entry.name[:-len('.html')]] = entry.stat().st_mtime_ns
+        return versions
+
+    def get_inspection_numbers(self) -> List[str]:
+        return sorted(self.get_versions())
+
+    def close(self) -> None:
+        pass
+
+
+class InspectionArchive:
+    """Stores pages compressed with zlib as blobs in SQLite file, pages are read by inspection number without
+    reading other pages. Version of page is time when it was written. Can be used from multiple threads.
+    Archive file is created by the first write, reading from archive that doesn't exist raises FileNotFoundError."""
+
+    def __init__(self, path: str):
+        self.location = path
+        self.connection: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.location)
+
+    def _connect(self, create: bool = False) -> sqlite3.Connection:
+        """Returns connection to archive, must be called under 'lock'."""
+        if self.connection is None:
+            if not create and not self.exists():
+                raise FileNotFoundError(f'No inspection archive {self.location}')
+            self.connection = sqlite3.connect(self.location, timeout=30, check_same_thread=False)
+            with self.connection:
+                # Readers in other processes aren't blocked by writes
+                self.connection.execute('PRAGMA journal_mode=WAL')
+                self.connection.execute(
+                    'CREATE TABLE IF NOT EXISTS pages ('
+                    'inspection_number TEXT PRIMARY KEY, version INTEGER NOT NULL, content BLOB NOT NULL)'
+                )
+        return self.connection
+
+    def read(self, inspection_number) -> bytes:
+        with self.lock:
+            row = self._connect().execute(
+                'SELECT content FROM pages WHERE inspection_number = ?', (str(inspection_number),)
+            ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f'No inspection {inspection_number} in {self.location}')
+        return zlib.decompress(row[0])
+
+    def write(self, inspection_number, content: bytes) -> None:
+        compressed_content = zlib.compress(content, COMPRESSION_LEVEL)
+        with self.lock, self._connect(create=True) as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?)',
+                (str(inspection_number), time.time_ns(), compressed_content),
+            )
+
+    def write_many(self, pages: Iterable[Tuple[str, bytes]]) -> None:
+        """Writes pages in one transaction."""
+        rows = [
+            (str(inspection_number), time.time_ns(), zlib.compress(content, COMPRESSION_LEVEL))
+            for inspection_number, content in pages
+        ]
+        with self.lock, self._connect(create=True) as connection:
+            connection.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)', rows)
+
+    def get_version(self, inspection_number) -> int:
+        with self.lock:
+            row = self._connect().execute(
+                'SELECT version FROM pages WHERE inspection_number = ?', (str(inspection_number),)
+            ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f'No inspection {inspection_number} in {self.location}')
+        return row[0]
+
+    def get_versions(self) -> Dict[str, int]:
+        """Returns versions of all pages by their inspection numbers."""
+        with self.lock:
+            return dict(self._connect().execute('SELECT inspection_number, version FROM pages'))
+
+    def get_inspection_numbers(self) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self._connect().execute(
+                'SELECT inspection_number FROM pages ORDER BY inspection_number'
+            )]
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+
+
+InspectionStorage = Union[InspectionFolder, InspectionArchive]
+
+
+def open_inspection_storage(location: str = INSPECTION_DETAILS_FOLDER_NAME) -> InspectionStorage:
+    """Returns archive if location ends with ARCHIVE_EXTENSION, otherwise folder."""
+    if location.endswith(ARCHIVE_EXTENSION):
+        return InspectionArchive(location)
+    return InspectionFolder(location)
+
+
+@lru_cache(maxsize=None)
+def _get_process_inspection_storage(location: str, process_id: int) -> InspectionStorage:
+    return open_inspection_storage(location)
+
+
+def get_inspection_storage(location: str = INSPECTION_DETAILS_FOLDER_NAME) -> InspectionStorage:
+    """Returns storage of location that is shared within process. Storages are cached per process id, so that
+    processes forked by pools open their own storage instead of using SQLite connection of their parent."""
+    return _get_process_inspection_storage(location, os.getpid())
+
+
+def copy_inspections(source_location: str, destination_location: str) -> int:
+    """Copies all pages between storages, e.g. to pack folder to archive. Returns number of copied pages."""
+    source = open_inspection_storage(source_location)
+    destination = open_inspection_storage(destination_location)
+    inspection_numbers = source.get_inspection_numbers()
+    for start in range(0, len(inspection_numbers), COPY_BATCH_SIZE):
+        destination.write_many(
+            (inspection_number, source.read(inspection_number))
+            for inspection_number in inspection_numbers[start: start + COPY_BATCH_SIZE]
+        )
+    source.close()
+    destination.close()
+    return len(inspection_numbers)
@@ -0,0 +1,385 @@
+"""Module for loading cleaned ITA (Injury Tracking Application) data through a columnar on-disk cache.
+Cache keeps one partition per year, so a new or re-issued release replaces only partitions of its years."""
+import codecs
+import json
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows, where app runs in one process
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+from constants import CACHE_FOLDER_NAME
+
+# Releases in order of ingestion with the year they are filed for, later release of the same year replaces earlier
+# one. Encodings are detected.
+ITA_FILE_NAMES = {
+    "ITA Data CY 2016.zip": 2016,
+    "ITA Data CY 2017.zip": 2017,
+    "ITA Data CY 2018.zip": 2018,
+    "ITA Data CY 2019.zip": 2019,
+    "ITA Data CY 2020.zip": 2020,
+    "ITA Data CY 2021 submitted thru 8-29-2022.zip": 2021,
+}
+# Year of releases absent in ITA_FILE_NAMES, e.g. 'ITA Data CY 2022.zip'
+RELEASE_YEAR_PATTERN = re.compile(r"CY (\d{4})")
+# Older releases are in Windows encoding, newer ones in UTF-8
+FALLBACK_ENCODING = "cp1252"
+ENCODING_DETECTION_BLOCK_SIZE = 1 << 20
+DROPPED_COLUMNS = [
+    "id",  # Unique number for each record
+    "street_address",
+    "zip_code",
+    "no_injuries_illnesses",  # Whether the establishment had any OSHA recordable work-related injuries or illnesses during the year
+    "total_other_cases",
+    "total_skin_disorders",
+    "total_poisonings",
+    "total_respiratory_conditions",
+    "total_hearing_loss",
+    "total_other_illnesses",
+    "created_timestamp",  # The date and time a record was submitted to the ITA
+    "change_reason",  # The reason why an establishment’s injury and illness summary was changed, if applicable
+]
+# Nullable integers for counts (they have missing values), categoricals for columns with few distinct values,
+# Arrow strings for names. Columns absent in data are skipped.
+ITA_DTYPES = {
+    "establishment_name": "string[pyarrow]",
+    "ein": "string[pyarrow]",
+    "company_name": "string[pyarrow]",
+    "city": "string[pyarrow]",
+    "state": "category",
+    "naics_code": "Int32",
+    "industry_description": "string[pyarrow]",
+    "establishment_type": "category",
+    "size": "category",
+    "annual_average_employees": "Int32",
+    "total_hours_worked": "Int64",
+    "total_deaths": "Int16",
+    "total_dafw_cases": "Int32",
+    "total_djtr_cases": "Int32",
+    "total_dafw_days": "Int32",
+    "total_djtr_days": "Int32",
+    "total_injuries": "Int32",
+    "establishment_id": "Int64",
+    "year_filing_for": "category",
+}
+# Categorical columns with numeric codes, their categories are integers instead of floats
+INTEGER_CATEGORY_COLUMNS = ["establishment_type", "size", "year_filing_for"]
+# Establishment can submit summary of the same year several times, only the latest one is kept
+DEDUPLICATION_COLUMNS = ["establishment_id", "year_filing_for"]
+MANIFEST_FILE_NAME = "ita_manifest.json"
+CACHE_LOCK_FILE_NAME = ".lock"
+# Releases parsed at once, peak memory of ingestion is about this number of raw releases
+INGESTION_MAX_WORKERS = 2
+PARTITIONS_READ_ATTEMPTS = 3
+# Must be increased whenever 'clean_ita_data' or partitioning changes, so that existing caches are rebuilt.
+CACHE_FORMAT_VERSION = 4
+
+
+def detect_encoding(file_name: str) -> str:
+    """Returns 'utf-8' if CSV file (zipped or not) is valid UTF-8, otherwise FALLBACK_ENCODING. The whole file is
+    decoded in blocks, because the first non-ASCII name can be anywhere in it."""
+    if zipfile.is_zipfile(file_name):
+        with zipfile.ZipFile(file_name) as zip_file:
+            csv_name = next(name for name in zip_file.namelist() if name.endswith(".csv"))
+            with zip_file.open(csv_name) as file:
+                return _detect_stream_encoding(file)
+    with open(file_name, "rb") as file:
+        return _detect_stream_encoding(file)
+
+
+def _detect_stream_encoding(file) -> str:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        while True:
+            block = file.read(ENCODING_DETECTION_BLOCK_SIZE)
+            decoder.decode(block, final=not block)
+            if not block:
+                return "utf-8"
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+
+
+def read_ita_file(file_name: str, encoding: Optional[str] = None) -> pd.DataFrame:
+    """Reads raw ITA CSV file (zipped or not) with multithreaded pyarrow parser. Encoding is detected if it isn't
+    passed. Files that pyarrow can't parse (e.g. with line breaks in quoted values) are read with C parser."""
+    encoding = encoding or detect_encoding(file_name)
+    try:
+        return pd.read_csv(file_name, encoding=encoding, engine="pyarrow")
+    except pa.ArrowInvalid as error:
+        print(f"{file_name} is read with C parser, because pyarrow failed: {error}")
+        return pd.read_csv(file_name, encoding=encoding, low_memory=False)
+
+
+def clean_ita_data(df: pd.DataFrame) -> pd.DataFrame:
+    """Drops unused columns and rows with missing or impossible values."""
+    df = df.drop(columns=DROPPED_COLUMNS)
+    df = df[~df["year_filing_for"].isna()]
+    df = df[df["annual_average_employees"] < 1000000]
+    df = df[df["total_hours_worked"] >= 0]
+    df = df[df["total_dafw_days"] >= 0]
+    df = df[df["total_djtr_days"] >= 0]
+    # Columns with mixed values (e.g. 'ein') can't be stored in columnar format, so they are unified to strings.
+    for column in df.select_dtypes(include="object").columns:
+        df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return apply_ita_dtypes(df.reset_index(drop=True))
+
+
+def get_memory_usage(df: pd.DataFrame) -> int:
+    """Returns number of bytes used by dataframe, including Python objects in object columns."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def apply_ita_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts columns to ITA_DTYPES and prints memory usage before and after conversion."""
+    memory_usage = get_memory_usage(df)
+    df = df.copy()
+    for column in INTEGER_CATEGORY_COLUMNS:
+        if column in df.columns and pd.api.types.is_numeric_dtype(df[column]):
+            categories = np.sort(df[column].dropna().unique()).astype(np.int16)
+            df[column] = pd.Categorical(df[column], categories=categories)
+    df = df.astype({column: dtype for column, dtype in ITA_DTYPES.items() if column in df.columns})
+    print(f"ITA data uses {get_memory_usage(df) / 2 ** 20:.1f} MiB instead of {memory_usage / 2 ** 20:.1f} MiB")
+    return df
+
+
+def deduplicate_ita_data(df: pd.DataFrame) -> pd.DataFrame:
+    """Keeps only the latest submission of every establishment for every year. Rows without establishment id
+    are kept, releases without establishment ids aren't changed. Submissions are ordered by parsed
+    'created_timestamp', timestamps that can't be parsed are the oldest."""
+    if not set(DEDUPLICATION_COLUMNS) <= set(df.columns):
+        return df
+    if "created_timestamp" in df.columns:
+        created = pd.to_datetime(df["created_timestamp"], errors="coerce").reset_index(drop=True)
+        df = df.iloc[created.sort_values(kind="mergesort", na_position="first").index]
+    duplicated = df.duplicated(subset=DEDUPLICATION_COLUMNS, keep="last") & df["establishment_id"].notna()
+    return df[~duplicated].sort_index()
+
+
+def get_source_stat(file_name: str) -> Dict[str, int]:
+    stat = os.stat(file_name)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def get_manifest_path(cache_folder: str = CACHE_FOLDER_NAME) -> str:
+    return os.path.join(cache_folder, MANIFEST_FILE_NAME)
+
+
+def read_manifest(cache_folder: str = CACHE_FOLDER_NAME) -> dict:
+    """Returns manifest of partitions in 'cache_folder'. Manifest of other format version is treated as empty,
+    so all partitions are rebuilt."""
+    empty_manifest = {"format_version": CACHE_FORMAT_VERSION, "version": 0, "sources": {}, "partitions": {}}
+    try:
+        with open(get_manifest_path(cache_folder), "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return empty_manifest
+    if manifest.get("format_version") != CACHE_FORMAT_VERSION:
+        return dict(empty_manifest, version=manifest.get("version", 0))
+    return manifest
+
+
+@contextmanager
+def cache_lock(cache_folder: str = CACHE_FOLDER_NAME) -> Iterator[None]:
+    """Holds exclusive lock of cache folder shared by all processes, e.g. to read, change and write manifest.
+    Lock isn't reentrant, so functions taking it don't call each other."""
+    os.makedirs(cache_folder, exist_ok=True)
+    with open(os.path.join(cache_folder, CACHE_LOCK_FILE_NAME), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_manifest(manifest: dict, cache_folder: str = CACHE_FOLDER_NAME, replaced_files: Iterable[str] = ()) -> None:
+    """Replaces manifest at once, so readers see either old or new set of partitions, then removes partition files
+    replaced by this write. Must be called under 'cache_lock' together with reading of manifest."""
+    manifest_path = get_manifest_path(cache_folder)
+    temporary_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(temporary_path, manifest_path)
+    used_files = {partition["file"] for partition in manifest["partitions"].values()}
+    for file_name in set(replaced_files) - used_files:
+        # Memory-mapped file stays readable by processes which still use it
+        try:
+            os.remove(os.path.join(cache_folder, file_name))
+        except FileNotFoundError:
+            pass
+
+
+def prepare_ita_file(file_name: str, encoding: Optional[str] = None) -> pd.DataFrame:
+    """Returns deduplicated (see 'deduplicate_ita_data') and cleaned data of one ITA release."""
+    return clean_ita_data(deduplicate_ita_data(read_ita_file(file_name, encoding)))
+
+
+def get_release_year(file_name: str, df: pd.DataFrame) -> int:
+    """Returns year which release is filed for: from ITA_FILE_NAMES, from 'CY <year>' in file name, or the most
+    frequent year in its data."""
+    if file_name in ITA_FILE_NAMES:
+        return ITA_FILE_NAMES[file_name]
+    match = RELEASE_YEAR_PATTERN.search(os.path.basename(file_name))
+    if match:
+        return int(match.group(1))
+    return int(df["year_filing_for"].value_counts().idxmax())
+
+
+def _write_ita_partitions(file_name: str, df: pd.DataFrame, cache_folder: str) -> List[int]:
+    """Replaces partition of the year of release (see 'get_release_year') with prepared data of release. Rows filed
+    for other years are dropped, so that a few stray rows don't replace partition of another release.
+    Must be called under 'cache_lock'."""
+    manifest = read_manifest(cache_folder)
+    replaced_files = []
+    version = manifest["version"] + 1
+    release_year = get_release_year(file_name, df)
+    stray_row_count = int((df["year_filing_for"] != release_year).sum())
+    if stray_row_count:
+        print(f"{stray_row_count} rows of {file_name} which aren't filed for {release_year} are dropped")
+    years = [release_year] if stray_row_count < len(df) else []
+    for year in years:
+        partition = df[(df["year_filing_for"] == year).to_numpy()].reset_index(drop=True)
+        partition_file = f"ita_{year}_v{version}.feather"
+        # Uncompressed file can be memory-mapped without decoding. Writing to temporary file and renaming it
+        # prevents other workers from reading half-written partition.
+        temporary_path = os.path.join(cache_folder, f"{partition_file}.{os.getpid()}.tmp")
+        feather.write_feather(partition, temporary_path, compression="uncompressed")
+        os.replace(temporary_path, os.path.join(cache_folder, partition_file))
+        if str(year) in manifest["partitions"]:
+            replaced_files.append(manifest["partitions"][str(year)]["file"])
+        manifest["partitions"][str(year)] = {"file": partition_file, "source": file_name, "rows": len(partition)}
+    # Years which were in previous snapshot of the same release but aren't in it anymore
+    for year, partition in list(manifest["partitions"].items()):
+        if partition["source"] == file_name and int(year) not in years:
+            replaced_files.append(partition["file"])
+            del manifest["partitions"][year]
+    manifest["sources"][file_name] = dict(get_source_stat(file_name), years=years)
+    manifest["version"] = version
+    write_manifest(manifest, cache_folder, replaced_files)
+    return years
+
+
+def ingest_ita_file(
+    file_name: str,
+    encoding: Optional[str] = None,
+    cache_folder: str = CACHE_FOLDER_NAME,
+) -> List[int]:
+    """Parses one ITA release and replaces partitions of years in it, other partitions aren't read.
+    Returns years of replaced partitions."""
+    df = prepare_ita_file(file_name, encoding)
+    with cache_lock(cache_folder):
+        return _write_ita_partitions(file_name, df, cache_folder)
+
+
+def ingest_ita_files(
+    file_names: Iterable[str] = ITA_FILE_NAMES,
+    cache_folder: str = CACHE_FOLDER_NAME,
+    max_workers: int = INGESTION_MAX_WORKERS,
+) -> List[int]:
+    """Ingests releases which are new or changed since they were ingested, or whose partitions were removed.
+    At most 'max_workers' releases are parsed in parallel and their partitions are written in the order of
+    'file_names', every prepared release is released after it is written. Missing files
+    are skipped. Partitions of releases ingested separately (e.g. by running this module with file name) are kept,
+    so the latest ingested release of a year wins. Returns years of replaced partitions.
+    The whole ingestion holds 'cache_lock', so processes started together ingest releases only once."""
+    with cache_lock(cache_folder):
+        manifest = read_manifest(cache_folder)
+        changed_names = []
+        for name in file_names:
+            if not os.path.exists(name):
+                print(f"{name} is skipped, because it doesn't exist")
+                continue
+            source = manifest["sources"].get(name)
+            if (
+                source is None
+                or {key: source[key] for key in ["size", "mtime_ns"]} != get_source_stat(name)
+                or any(str(year) not in manifest["partitions"] for year in source["years"])
+            ):
+                changed_names.append(name)
+
+        changed_years = []
+        with ThreadPoolExecutor(max_workers) as executor:
+            # 'executor.map' would submit all releases at once and keep all prepared frames until they are written
+            futures = [executor.submit(prepare_ita_file, name) for name in changed_names[:max_workers]]
+            for position, name in enumerate(changed_names):
+                df = futures[position].result()
+                futures[position] = None
+                if position + max_workers < len(changed_names):
+                    futures.append(executor.submit(prepare_ita_file, changed_names[position + max_workers]))
+                changed_years += _write_ita_partitions(name, df, cache_folder)
+                del df
+        return changed_years
+
+
+def get_data_version(cache_folder: str = CACHE_FOLDER_NAME) -> int:
+    """Returns version of partitions, it is increased by every ingestion."""
+    return read_manifest(cache_folder)["version"]
+
+
+def read_ita_partitions(
+    cache_folder: str = CACHE_FOLDER_NAME,
+    columns: Optional[List[str]] = None,
+) -> Tuple[int, pd.DataFrame]:
+    """Returns version and dataframe of all partitions sorted by year, partitions are memory-mapped.
+    Only 'columns' are read if they are passed."""
+    for attempt in range(PARTITIONS_READ_ATTEMPTS):
+        manifest = read_manifest(cache_folder)
+        try:
+            tables = [
+                feather.read_table(os.path.join(cache_folder, partition["file"]), columns=columns, memory_map=True)
+                for _, partition in sorted(manifest["partitions"].items())
+            ]
+            break
+        except FileNotFoundError:
+            # Partition was replaced by ingestion after manifest was read
+            if attempt == PARTITIONS_READ_ATTEMPTS - 1:
+                raise
+    if not tables:
+        raise FileNotFoundError(f"No ITA partitions in {cache_folder}")
+    # Categories of categorical columns are different in partitions, they are unified when converted to pandas
+    df = pa.concat_tables(tables, promote_options="default").to_pandas()
+    return manifest["version"], df
+
+
+def get_ita_column_names(cache_folder: str = CACHE_FOLDER_NAME) -> List[str]:
+    """Returns names of columns of partitions, only schema of the first partition is read."""
+    manifest = read_manifest(cache_folder)
+    if not manifest["partitions"]:
+        raise FileNotFoundError(f"No ITA partitions in {cache_folder}")
+    _, partition = min(manifest["partitions"].items())
+    with pa.memory_map(os.path.join(cache_folder, partition["file"])) as source:
+        return pa.ipc.open_file(source).schema.names
+
+
+def load_ita_data(
+    file_names: Iterable[str] = ITA_FILE_NAMES,
+    cache_folder: str = CACHE_FOLDER_NAME,
+) -> pd.DataFrame:
+    """Returns cleaned ITA dataframe. Yearly partitions are read from memory-mapped Feather files in 'cache_folder',
+    releases which are new or changed since the last load are ingested first (see 'ingest_ita_files')."""
+    ingest_ita_files(file_names, cache_folder)
+    return read_ita_partitions(cache_folder)[1]
+
+
+if __name__ == "__main__":
+    # App ingests releases itself, running this before starting it (e.g. before gunicorn) only moves the work
+    # out of the first page load: python ita_data.py
+    # One release: python ita_data.py "ITA Data CY 2022.zip" (encoding can be passed after file name)
+    import sys
+
+    if len(sys.argv) > 1:
+        print(f"Replaced partitions of years {ingest_ita_file(*sys.argv[1:3])}")
+    else:
+        print(f"Replaced partitions of years {ingest_ita_files()}")
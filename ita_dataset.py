@@ -0,0 +1,85 @@
+"""Module for the version of ITA data used by running app. When ingestion (see 'ita_data.ingest_ita_files') creates
+a new version of partitions, app switches to it without restart."""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from constants import CACHE_FOLDER_NAME
+from filter_engine import FilterIndex
+from ita_data import ITA_FILE_NAMES, get_data_version, ingest_ita_files, read_ita_partitions
+from rollup_cube import RollupCube
+from shared_dataset import read_snapshot
+
+RELOAD_CHECK_INTERVAL = 5.0  # Seconds between checks of manifest version
+
+
+@dataclass(frozen=True)
+class ItaDataset:
+    """Dataframe with structures built over it. Callbacks take dataset once and use only its attributes,
+    so positions from 'index' always belong to 'data', even if dataset is switched meanwhile."""
+    version: int
+    data: pd.DataFrame
+    index: FilterIndex
+    cube: RollupCube
+
+
+def build_ita_dataset(cache_folder: str = CACHE_FOLDER_NAME, shared: bool = False) -> ItaDataset:
+    """Builds dataset from partitions. If 'shared', data and filter index are memory-mapped from snapshot which is
+    shared by all processes (see 'shared_dataset'), only the small rollup cube is built by every process."""
+    if shared:
+        version, data, index = read_snapshot(cache_folder)
+    else:
+        version, data = read_ita_partitions(cache_folder)
+        index = FilterIndex(data)
+    return ItaDataset(version=version, data=data, index=index, cube=RollupCube(data))
+
+
+class ItaDatasetHolder:
+    """Keeps current dataset and replaces it with a new one when version of partitions changes. Version is checked
+    at most once per 'check_interval' seconds. New dataset is built while the old one keeps serving requests,
+    then the reference is swapped at once. Every process (e.g. gunicorn worker) switches on its own.
+    The first dataset is built by the first 'get', so creating holder (e.g. when worker starts) is cheap.
+    Before every check releases in 'file_names' which are new or changed are ingested (see 'ingest_ita_files'), so
+    an empty cache is filled by the first worker and replaced release files are noticed while app runs. Ingestion
+    holds cache lock, so other workers wait for it instead of ingesting again. None disables ingestion.
+    If 'shared', datasets are memory-mapped from snapshots shared by all processes (see 'build_ita_dataset')."""
+
+    def __init__(
+        self,
+        cache_folder: str = CACHE_FOLDER_NAME,
+        check_interval: float = RELOAD_CHECK_INTERVAL,
+        shared: bool = False,
+        file_names: Optional[Iterable[str]] = ITA_FILE_NAMES,
+    ):
+        self.cache_folder = cache_folder
+        self.file_names = list(file_names) if file_names is not None else None
+        self.check_interval = check_interval
+        self.shared = shared
+        self.dataset: Optional[ItaDataset] = None
+        self._next_check_time = time.monotonic() + check_interval
+        self._reload_lock = threading.Lock()
+
+    def reload(self) -> bool:
+        """Switches to the latest version of partitions if it differs from current one. Returns True if it did."""
+        with self._reload_lock:
+            if self.file_names is not None:
+                ingest_ita_files(self.file_names, self.cache_folder)
+            if self.dataset is not None and get_data_version(self.cache_folder) == self.dataset.version:
+                return False
+            self.dataset = build_ita_dataset(self.cache_folder, self.shared)
+            print(f"Switched to version {self.dataset.version} of ITA data ({len(self.dataset.data)} rows)")
+            return True
+
+    def get(self) -> ItaDataset:
+        """Returns current dataset. If 'check_interval' passed since the last check, new version is looked for in
+        background thread, so the request isn't delayed by building it."""
+        if self.dataset is None:
+            self.reload()
+            self._next_check_time = time.monotonic() + self.check_interval
+        elif time.monotonic() >= self._next_check_time and not self._reload_lock.locked():
+            self._next_check_time = time.monotonic() + self.check_interval
+            threading.Thread(target=self.reload, daemon=True).start()
+        return self.dataset
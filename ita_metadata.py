@@ -0,0 +1,78 @@
+"""Module for small metadata of ITA data which is needed to build app layout: dropdown options, bounds of range
+sliders and column names. It is computed once per version of partitions and saved next to them, so starting app
+(e.g. every gunicorn worker) reads a small JSON file instead of scanning the whole dataset."""
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from constants import CACHE_FOLDER_NAME
+from filter_engine import RANGE_COLUMNS
+from ita_data import get_data_version, get_ita_column_names, read_ita_partitions
+from naics_codes import get_naics_options
+
+METADATA_FILE_NAME = "ita_metadata.json"
+METADATA_FORMAT_VERSION = 2  # Saved metadata of other format is computed again
+
+
+def _to_json_number(value) -> float:
+    """Returns int or float of numpy or pandas scalar, 0 for missing value (e.g. column without values)."""
+    if pd.isna(value):
+        return 0
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def build_ita_metadata(df: pd.DataFrame, version: int, columns: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Returns metadata of dataframe: names of 'columns' (all columns of df by default), sorted states and years,
+    NAICS options (see 'naics_codes.get_naics_options', named by 'industry_description' if df has it) and
+    [min, max] of every column in RANGE_COLUMNS."""
+    return {
+        "format_version": METADATA_FORMAT_VERSION,
+        "version": version,
+        "rows": len(df),
+        "columns": list(columns if columns is not None else df.columns),
+        "states": sorted(str(state) for state in df["state"].dropna().unique()),
+        "years": sorted(int(year) for year in df["year_filing_for"].dropna().unique()),
+        "naics_options": get_naics_options(df["naics_code"], df.get("industry_description")),
+        "ranges": {
+            column: [_to_json_number(df[column].min()), _to_json_number(df[column].max())]
+            for column in RANGE_COLUMNS
+        },
+    }
+
+
+def get_metadata_path(cache_folder: str = CACHE_FOLDER_NAME) -> str:
+    return os.path.join(cache_folder, METADATA_FILE_NAME)
+
+
+def read_ita_metadata(cache_folder: str = CACHE_FOLDER_NAME) -> Optional[Dict[str, Any]]:
+    """Returns saved metadata, None if it doesn't exist."""
+    try:
+        with open(get_metadata_path(cache_folder), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_ita_metadata(metadata: Dict[str, Any], cache_folder: str = CACHE_FOLDER_NAME) -> None:
+    """Replaces metadata at once, so that other workers never read a half-written file."""
+    metadata_path = get_metadata_path(cache_folder)
+    temporary_path = f"{metadata_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(metadata, file)
+    os.replace(temporary_path, metadata_path)
+
+
+def get_ita_metadata(cache_folder: str = CACHE_FOLDER_NAME) -> Dict[str, Any]:
+    """Returns metadata of the current version of partitions. If saved metadata belongs to another version, it is
+    computed from memory-mapped partitions (only columns it needs are read) and saved."""
+    metadata = read_ita_metadata(cache_folder)
+    if (metadata is not None and metadata.get("format_version") == METADATA_FORMAT_VERSION
+            and metadata["version"] == get_data_version(cache_folder)):
+        return metadata
+    version, df = read_ita_partitions(
+        cache_folder, ["state", "year_filing_for", "naics_code", "industry_description"] + RANGE_COLUMNS)
+    metadata = build_ita_metadata(df, version, get_ita_column_names(cache_folder))
+    write_ita_metadata(metadata, cache_folder)
+    return metadata
@@ -0,0 +1,180 @@
+"""Module for vectorized decoding of NAICS codes. Codes of every level in NAICS_AGGREGATION_LEVELS are derived from
+'naics_code' column with integer division, so filtering and grouping by any level are integer operations.
+Definitions: https://www.census.gov/naics/"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import constants
+from constants import NAICS_AGGREGATION_LEVELS, get_derived_mapping
+
+NON_CLASSIFIABLE = 'Non-classifiable'
+# Number of digits: column name, e.g. 2: 'naics_sector'
+NAICS_LEVEL_COLUMNS: Dict[int, str] = {
+    int(digits): 'naics_' + level_name.lower().replace(' ', '_')
+    for digits, level_name in NAICS_AGGREGATION_LEVELS.items()
+}
+NAICS_CODE_DTYPE = 'Int32'
+NAICS_CODE_DIGITS = max(NAICS_LEVEL_COLUMNS)
+NAICS_OPTION_INDENT = '\u2003'  # Em space, options are indented by their level
+
+
+def get_digit_counts(naics_codes: np.ndarray) -> np.ndarray:
+    """Returns number of digits of positive codes, 0 for missing and non-positive codes."""
+    digit_counts = np.zeros(len(naics_codes), dtype=np.int64)
+    valid = naics_codes >= 1  # False for NaN
+    digit_counts[valid] = np.floor(np.log10(naics_codes[valid])).astype(np.int64) + 1
+    return digit_counts
+
+
+def get_level_codes(naics_code: pd.Series, digits: int) -> pd.Series:
+    """Returns first 'digits' digits of codes, like 'str[:digits]' of their strings. Codes with fewer digits
+    and missing codes are missing."""
+    naics_codes = np.trunc(naics_code.to_numpy(dtype='float64', na_value=np.nan))
+    digit_counts = get_digit_counts(naics_codes)
+    valid = digit_counts >= digits
+    level_codes = np.zeros(len(naics_codes), dtype=np.int64)
+    level_codes[valid] = naics_codes[valid].astype(np.int64) // 10 ** (digit_counts[valid] - digits)
+    return pd.Series(level_codes, index=naics_code.index, name=NAICS_LEVEL_COLUMNS.get(digits)) \
+        .astype(NAICS_CODE_DTYPE).where(valid)
+
+
+def _build_label_lookup(names: Dict[str, str], digits: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns names as categories and code of category for every possible code of level, -1 is missing."""
+    categories = pd.unique(pd.Series(list(names.values()), dtype=object))
+    category_positions = {name: position for position, name in enumerate(categories)}
+    lookup = np.full(10 ** digits, -1, dtype=np.int64)
+    for code, name in names.items():
+        if len(code) == digits:
+            lookup[int(code)] = category_positions[name]
+    return categories, lookup
+
+
+def _get_labels(level_codes: pd.Series, mapping_name: str, digits: int) -> pd.Categorical:
+    """Returns categorical of names of codes from mapping, unknown and missing codes are missing."""
+    categories, lookup = get_derived_mapping(
+        f'{mapping_name}_LABEL_LOOKUP', lambda: _build_label_lookup(getattr(constants, mapping_name), digits))
+    category_codes = lookup[level_codes.fillna(0).to_numpy(dtype=np.int64)]
+    category_codes[level_codes.isna().to_numpy()] = -1
+    return pd.Categorical.from_codes(category_codes, categories=categories)
+
+
+def get_sector_labels(naics_code: pd.Series) -> pd.Series:
+    """Vectorized 'helpers.parse_two_digit_naics_code': categorical names of sectors from 'TWO_DIGIT_NAICS.json',
+    NON_CLASSIFIABLE for missing codes. Unknown sectors are missing."""
+    sector_codes = get_level_codes(naics_code, 2)
+    labels = pd.Series(_get_labels(sector_codes, 'TWO_DIGIT_NAICS', 2), index=naics_code.index,
+                       name='naics_sector_name')
+    if NON_CLASSIFIABLE not in labels.cat.categories:
+        labels = labels.cat.add_categories(NON_CLASSIFIABLE)
+    return labels.where(sector_codes.notna(), NON_CLASSIFIABLE)
+
+
+def get_industry_group_labels(naics_code: pd.Series) -> pd.Series:
+    """Vectorized 'helpers.parse_four_digit_naics_code': categorical names of industry groups from
+    'FOUR_DIGIT_NAICS.json', 'Other {sector name}' for groups absent in it, NON_CLASSIFIABLE for missing codes."""
+    sector_labels = get_sector_labels(naics_code)
+    group_labels = _get_labels(get_level_codes(naics_code, 4), 'FOUR_DIGIT_NAICS', 4)
+    other_labels = ('Other ' + sector_labels.astype(object)).where(naics_code.notna(), NON_CLASSIFIABLE)
+    labels = pd.Series(group_labels.astype(object), index=naics_code.index).fillna(other_labels)
+    return labels.astype('category').rename('naics_industry_group_name')
+
+
+def decode_naics_codes(naics_code: pd.Series) -> pd.DataFrame:
+    """Returns dataframe with integer codes of every level in NAICS_LEVEL_COLUMNS and categorical names of sectors
+    and industry groups, indexed like 'naics_code' column."""
+    decoded = pd.DataFrame({column: get_level_codes(naics_code, digits)
+                            for digits, column in NAICS_LEVEL_COLUMNS.items()})
+    decoded['naics_sector_name'] = get_sector_labels(naics_code)
+    decoded['naics_industry_group_name'] = get_industry_group_labels(naics_code)
+    return decoded
+
+
+def get_naics_mask(naics_code: pd.Series, prefixes: Iterable[int]) -> pd.Series:
+    """Returns mask of rows whose codes start with any of prefixes, e.g. [23, 4911]. Prefixes of different
+    levels can be mixed, level of prefix is its number of digits."""
+    prefixes_by_digits: Dict[int, list] = {}
+    for prefix in prefixes:
+        prefixes_by_digits.setdefault(len(str(int(prefix))), []).append(int(prefix))
+    mask = pd.Series(False, index=naics_code.index)
+    for digits, level_prefixes in prefixes_by_digits.items():
+        mask |= get_level_codes(naics_code, digits).isin(level_prefixes).fillna(False).astype(bool)
+    return mask
+
+
+def get_padded_codes(naics_code: pd.Series) -> np.ndarray:
+    """Returns codes padded with zeros to NAICS_CODE_DIGITS digits and followed by their number of digits as the last
+    digit (e.g. 44511 -> 4451105, 445110 -> 4451106), so that codes with the same prefix form a contiguous range in
+    sorted order, and shorter codes with the same padded value (44511) are sorted before longer ones (445110).
+    Missing codes are NaN."""
+    naics_codes = np.trunc(naics_code.to_numpy(dtype='float64', na_value=np.nan))
+    digit_counts = get_digit_counts(naics_codes)
+    padded_codes = np.full(len(naics_codes), np.nan)
+    valid = (digit_counts > 0) & (digit_counts <= NAICS_CODE_DIGITS)
+    padded_codes[valid] = naics_codes[valid] * 10.0 ** (NAICS_CODE_DIGITS + 1 - digit_counts[valid]) \
+        + digit_counts[valid]
+    return padded_codes
+
+
+def get_prefix_ranges(prefixes: Iterable) -> List[Tuple[int, int]]:
+    """Returns sorted disjoint [start, end) ranges of padded codes (see 'get_padded_codes') starting with any of
+    prefixes. Prefixes can be of any level, e.g. ['23', '4911', 311710], nested prefixes are merged. Codes shorter
+    than prefix don't match it, e.g. 44511 doesn't match 445110: range starts after its padded value."""
+    ranges = []
+    for prefix in prefixes:
+        prefix = str(int(prefix))
+        scale = 10 ** (NAICS_CODE_DIGITS + 1 - len(prefix))
+        ranges.append((int(prefix) * scale + len(prefix), (int(prefix) + 1) * scale))
+    merged_ranges = []
+    for start, end in sorted(ranges):
+        if merged_ranges and start <= merged_ranges[-1][1]:
+            merged_ranges[-1] = (merged_ranges[-1][0], max(end, merged_ranges[-1][1]))
+        else:
+            merged_ranges.append((start, end))
+    return merged_ranges
+
+
+def get_industry_names(naics_code: pd.Series, industry_description: pd.Series) -> Dict[str, str]:
+    """Returns the most frequent description of every code in column, e.g. names of 6-digit codes which are absent
+    in NAICS mapping files."""
+    pairs = pd.DataFrame({
+        'code': naics_code.astype('Int64').astype('string'),
+        'name': industry_description.astype('string').str.strip().replace('', pd.NA),
+    }).dropna()
+    names = pairs.value_counts().reset_index().drop_duplicates('code')
+    return dict(zip(names['code'], names['name']))
+
+
+def _get_own_naics_name(code: str, industry_names: Dict[str, str]) -> Optional[str]:
+    return constants.FOUR_DIGIT_NAICS.get(code) or constants.TWO_DIGIT_NAICS.get(code) or industry_names.get(code)
+
+
+def get_naics_name(code: str, industry_names: Optional[Dict[str, str]] = None) -> str:
+    """Returns name of code from 'FOUR_DIGIT_NAICS.json', 'TWO_DIGIT_NAICS.json' or industry_names (see
+    'get_industry_names'). Codes without name (e.g. 3- and 5-digit codes) get name of the nearest parent in
+    parentheses, e.g. '(Construction)' for 236, and name of their level if no parent has name."""
+    industry_names = industry_names or {}
+    name = _get_own_naics_name(code, industry_names)
+    if name:
+        return name
+    for digits in range(len(code) - 1, 1, -1):
+        parent_name = _get_own_naics_name(code[:digits], industry_names)
+        if parent_name:
+            return f'({parent_name})'
+    return NAICS_AGGREGATION_LEVELS[str(len(code))]
+
+
+def get_naics_options(naics_code: pd.Series, industry_description: Optional[pd.Series] = None) -> List[Dict[str, str]]:
+    """Returns dropdown options for codes of every level that are present in column. Options are sorted like
+    depth-first traversal of prefix tree (every code is followed by its subcodes) and indented by level.
+    Codes are named by 'get_naics_name', 6-digit codes by their 'industry_description' in dataset if it's passed."""
+    industry_names = get_industry_names(naics_code, industry_description) if industry_description is not None else {}
+    codes = set()
+    for digits in NAICS_LEVEL_COLUMNS:
+        codes.update(str(code) for code in get_level_codes(naics_code, digits).dropna().unique())
+    return [
+        {'label': f'{NAICS_OPTION_INDENT * (len(code) - 2)}{code} {get_naics_name(code, industry_names)}',
+         'value': code}
+        for code in sorted(codes)
+    ]
@@ -0,0 +1,77 @@
+"""Module for vectorized unification of names in columns. Nested dictionaries like 'EMPLOYER_NORMALIZED_NAMES.json'
+are inverted once, so that every old name is looked up in O(1) instead of searching all lists for every row."""
+import timeit
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+import constants
+from constants import get_derived_mapping
+
+
+def build_reverse_lookup(names_dict: Dict[str, List[str]]) -> Dict[str, str]:
+    """Returns unified name of every old name. If old name is in several lists, the first unified name is used,
+    like in loop over dictionary."""
+    reverse_lookup = {}
+    for unified_name, old_names_list in names_dict.items():
+        for old_name in old_names_list:
+            reverse_lookup.setdefault(old_name, unified_name)
+    return reverse_lookup
+
+
+def get_employer_names_lookup() -> Dict[str, str]:
+    return get_derived_mapping(
+        'EMPLOYER_NAMES_LOOKUP', lambda: build_reverse_lookup(constants.EMPLOYER_NORMALIZED_NAMES))
+
+
+def get_fatality_or_catastrophe_names_lookup() -> Dict[str, str]:
+    return get_derived_mapping(
+        'FATALITY_OR_CATASTROPHE_NAMES_LOOKUP', lambda: build_reverse_lookup(constants.FATALITY_OR_CATASTROPHE_NAMES))
+
+
+# Lookups are built on first access of these names (PEP 562)
+_LOOKUP_GETTERS = {
+    'EMPLOYER_NAMES_LOOKUP': get_employer_names_lookup,
+    'FATALITY_OR_CATASTROPHE_NAMES_LOOKUP': get_fatality_or_catastrophe_names_lookup,
+}
+
+
+def __getattr__(name: str):
+    if name in _LOOKUP_GETTERS:
+        return _LOOKUP_GETTERS[name]()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def map_names(column: pd.Series, reverse_lookup: Dict[str, str]) -> pd.Series:
+    """Replaces names in column by their unified names, names absent in lookup (and missing values) are kept.
+    Every distinct value is looked up only once."""
+    codes, uniques = pd.factorize(column)
+    # The last item is taken by code -1 of missing values, which are then restored from column
+    mapped_uniques = np.array([reverse_lookup.get(name, name) for name in uniques] + [None], dtype=object)
+    return pd.Series(mapped_uniques[codes], index=column.index, name=column.name).where(codes != -1, column)
+
+
+def normalize_employer_names(column: pd.Series) -> pd.Series:
+    """Vectorized 'helpers.mapping_employer_names'."""
+    return map_names(column, get_employer_names_lookup())
+
+
+def normalize_fatality_or_catastrophe_names(column: pd.Series) -> pd.Series:
+    """Vectorized 'helpers.unification_of_fatalities'."""
+    return map_names(column, get_fatality_or_catastrophe_names_lookup())
+
+
+def benchmark_normalization(column: pd.Series, row_function: Callable[[str], str],
+                            column_function: Callable[[pd.Series], pd.Series], number: int = 3) -> Dict[str, float]:
+    """Returns the best of 'number' times (in seconds) of applying row function and column function to column.
+    Baseline row functions are the original loops over all lists, e.g.
+    benchmark_normalization(df['company_name'], helpers._mapping_employer_names_linear, normalize_employer_names)
+    or benchmark_normalization(fatality_names, helpers._unification_of_fatalities_linear,
+    normalize_fatality_or_catastrophe_names)"""
+    if not column.apply(row_function).equals(column_function(column)):
+        raise ValueError('Row function and column function return different results')
+    return {
+        'apply': min(timeit.repeat(lambda: column.apply(row_function), number=1, repeat=number)),
+        'vectorized': min(timeit.repeat(lambda: column_function(column), number=1, repeat=number)),
+    }
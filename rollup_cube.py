@@ -0,0 +1,74 @@
+"""Module for rollup cube of ITA data: sums of measures are precomputed once for every combination of state, year,
+NAICS sector and ownership, so aggregate queries group the small cube instead of all establishments."""
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from naics_codes import get_level_codes
+
+CUBE_DIMENSIONS = ["state", "year_filing_for", "naics_sector", "establishment_type"]
+# Dimensions with integer values, e.g. to parse values from query string
+INTEGER_CUBE_DIMENSIONS = ["year_filing_for", "naics_sector", "establishment_type"]
+CUBE_MEASURES = [
+    "annual_average_employees",
+    "total_hours_worked",
+    "total_deaths",
+    "total_dafw_cases",
+    "total_djtr_cases",
+    "total_dafw_days",
+    "total_djtr_days",
+    "total_injuries",
+]
+ESTABLISHMENTS_COLUMN = "establishments"
+RATE_HOURS = 200_000  # 100 full-time employees working 40 hours a week for 50 weeks
+# Rate column: numerator columns, all rates are per RATE_HOURS hours worked
+CUBE_RATES = {
+    "injury_rate": ["total_injuries"],
+    "dafw_rate": ["total_dafw_cases"],
+    "dart_rate": ["total_dafw_cases", "total_djtr_cases"],
+}
+
+
+class RollupCube:
+    """Sums of CUBE_MEASURES and numbers of establishments for every combination of CUBE_DIMENSIONS present in
+    data. Missing values of dimensions are kept as separate cells, missing measures are skipped in sums."""
+
+    def __init__(self, df: pd.DataFrame):
+        dimensions = pd.DataFrame({
+            "state": df["state"],
+            "year_filing_for": df["year_filing_for"],
+            "naics_sector": get_level_codes(df["naics_code"], 2),
+            "establishment_type": df["establishment_type"],
+        })
+        measures = df[CUBE_MEASURES].astype("float64").assign(**{ESTABLISHMENTS_COLUMN: 1})
+        self.cells = (
+            pd.concat([dimensions, measures], axis="columns")
+            .groupby(CUBE_DIMENSIONS, observed=True, dropna=False, sort=True)
+            .sum()
+            .reset_index()
+        )
+
+    def query(
+        self,
+        group_by: Sequence[str] = (),
+        filters: Optional[Dict[str, Sequence]] = None,
+    ) -> pd.DataFrame:
+        """Returns sums of measures and CUBE_RATES grouped by some of CUBE_DIMENSIONS (one total row if 'group_by'
+        is empty) for cells which have any of values of every dimension in 'filters'."""
+        unknown_dimensions = (set(group_by) | set(filters or {})) - set(CUBE_DIMENSIONS)
+        if unknown_dimensions:
+            raise ValueError(f"Unknown dimensions: {sorted(unknown_dimensions)}")
+        cells = self.cells
+        for dimension, values in (filters or {}).items():
+            cells = cells[cells[dimension].isin(values).to_numpy(dtype=bool, na_value=False)]
+        measures = CUBE_MEASURES + [ESTABLISHMENTS_COLUMN]
+        if group_by:
+            result = cells.groupby(list(group_by), observed=True, dropna=False, sort=True)[measures].sum().reset_index()
+        else:
+            result = cells[measures].sum().to_frame().T
+        hours = result["total_hours_worked"].where(result["total_hours_worked"] > 0)
+        for rate, numerators in CUBE_RATES.items():
+            result[rate] = result[numerators].sum(axis="columns") * RATE_HOURS / hours
+        result[ESTABLISHMENTS_COLUMN] = result[ESTABLISHMENTS_COLUMN].astype(np.int64)
+        return result
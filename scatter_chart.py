@@ -0,0 +1,55 @@
+"""Module for building scatter chart of establishments that stays responsive for any number of points.
+Small selections are drawn as SVG, bigger ones with WebGL, and the biggest ones are aggregated on the server
+to 2D histogram on log-x axis with optional sample of outliers drawn above it."""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+SVG_POINTS_LIMIT = 5_000
+WEBGL_POINTS_LIMIT = 150_000
+HISTOGRAM_BINS = (120, 80)  # Number of bins along log-x and y axes
+OUTLIER_BIN_COUNT = 2  # Points in bins with so few points are considered outliers
+OUTLIERS_PER_GROUP = 50
+
+
+def build_scatter_chart(df: pd.DataFrame, x: str, y: str, color: str, show_outliers: bool = True) -> go.Figure:
+    """Returns scatter chart with log-x axis, rendering mode is chosen by number of rows."""
+    if len(df) <= SVG_POINTS_LIMIT:
+        return px.scatter(df, x=x, y=y, color=color, log_x=True, size_max=100, render_mode="svg")
+    if len(df) <= WEBGL_POINTS_LIMIT:
+        return px.scatter(df, x=x, y=y, color=color, log_x=True, size_max=100, render_mode="webgl")
+    return build_density_chart(df, x, y, color, show_outliers)
+
+
+def build_density_chart(df: pd.DataFrame, x: str, y: str, color: str, show_outliers: bool = True) -> go.Figure:
+    """Returns heatmap with numbers of rows in bins of log-x and y. Rows that can't be drawn on log axis are
+    skipped like in scatter chart. If 'show_outliers', rows from sparse bins are sampled (stratified by 'color'
+    column) and drawn as points above heatmap."""
+    x_values = df[x].to_numpy(dtype="float64", na_value=np.nan)
+    y_values = df[y].to_numpy(dtype="float64", na_value=np.nan)
+    valid = (x_values > 0) & ~np.isnan(y_values)
+    log_x_values = np.log10(x_values[valid])
+    y_values = y_values[valid]
+    counts, x_edges, y_edges = np.histogram2d(log_x_values, y_values, bins=HISTOGRAM_BINS)
+
+    outliers = df.iloc[:0]
+    if show_outliers and len(log_x_values):
+        x_bins = np.clip(np.searchsorted(x_edges, log_x_values, side="right") - 1, 0, len(x_edges) - 2)
+        y_bins = np.clip(np.searchsorted(y_edges, y_values, side="right") - 1, 0, len(y_edges) - 2)
+        sparse = counts[x_bins, y_bins] <= OUTLIER_BIN_COUNT
+        outliers = df.iloc[np.flatnonzero(valid)[sparse]]
+        outliers = outliers.sample(frac=1, random_state=0).groupby(color, sort=False).head(OUTLIERS_PER_GROUP)
+
+    scatter = px.scatter(outliers, x=x, y=y, color=color, log_x=True, render_mode="webgl")
+    heatmap = go.Heatmap(
+        x=10 ** x_edges,  # Bin edges, so that cells are aligned with log axis
+        y=y_edges,
+        z=np.where(counts > 0, counts, np.nan).T,
+        colorscale="Blues",
+        colorbar={"title": {"text": "Establishments"}, "x": -0.15},
+        hovertemplate=f"{x}: %{{x}}<br>{y}: %{{y}}<br>Establishments: %{{z}}<extra></extra>",
+    )
+    figure = go.Figure(data=[heatmap, *scatter.data], layout=scatter.layout)
+    figure.update_layout(title={"text": f"{len(log_x_values):,} establishments aggregated to bins"})
+    return figure
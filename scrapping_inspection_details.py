@@ -1,11 +1,16 @@
 """Module for working with Inspection Details files"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from typing import Literal
-import urllib.error
-from dataclasses import dataclass, fields
-from bs4 import BeautifulSoup
+from dataclasses import astuple, dataclass, fields
+from lxml import html as lxml_html
 import pandas as pd
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Tuple
 from constants import NULL_INT, NULL_STRING, INSPECTION_DETAILS_FOLDER_NAME
+from inspection_storage import get_inspection_storage
+
+HTML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+VIOLATION_SUMMARY_TITLE = 'Violation Summary'
 
 
 @dataclass
@@ -30,6 +35,16 @@ class Inspection:
     total_initial_penalty: str
     total_current_penalty: str
     total_fta_penalty: str
+    # Written here instead of 'dataclass(slots=True)', which needs Python 3.10. Fields have no defaults,
+    # so slots don't conflict with class attributes
+    __slots__ = tuple(__annotations__)
+
+
+# Dtypes of columns with Inspection fields in dataframe returned by 'parse_inspection_files'
+INSPECTION_DTYPES = {
+    field.name: 'Int64' if field.type is int else 'string' if field.type is str else 'category'
+    for field in fields(Inspection)
+}
 
 
 DATASETS_DICT = {
@@ -300,80 +315,179 @@ DATASETS_DICT = {
 }
 
 
-def get_case_status(path_to_file: str) -> str:
-    """Parses case status from **Inspection Details**. Used to refresh file with 'Open' cases."""
-    with open(path_to_file, 'r', encoding='utf-8') as file:
-        case_status = BeautifulSoup(file.read(), 'html.parser')\
-            .find('div', {'class': "well well-small"})
-    return case_status.text[len('Case Status: '):] if case_status is not None else NULL_STRING
+def read_html_content(content: bytes):
+    """Returns root element of HTML document. Line endings are converted like in files opened in text mode."""
+    return lxml_html.fromstring(content.replace(b'\r\n', b'\n').replace(b'\r', b'\n'), parser=HTML_PARSER)
 
 
-def parse_inspection_file(path_to_file: str) -> Inspection:
-    """Parses information from **Inspection Details** file and returns it as instance of Inspection
-     dataclass.\n
-    File example: https://www.osha.gov/ords/imis/establishment.inspection_detail?id=1595777.015 \n
-    Definitions: https://www.osha.gov/data/inspection-detail-definitions#tab1
-    """
-    with open(path_to_file, 'r', encoding='utf-8') as file:
-        soup = BeautifulSoup(file.read(), 'html.parser')
-        case_status = soup.find('div', {'class': "well well-small"})
-        span4_list = soup.find_all('div', {'class': "span4"})
-        text_with_naics = span4_list[5].text
-        naics_list = text_with_naics[text_with_naics.index('\nNAICS: ') + 8: -1].split('/')
-        split_list = span4_list[6].text.split('\n')
-        employer_str = soup.find('h4').text
-    try:
-        violation_summary_table = pd.read_html(path_to_file, match='Violation Summary')[0]
-    except (urllib.error.URLError, ValueError, IndexError, KeyboardInterrupt):
-        violation_summary_table = []
+def is_case_status_element(element) -> bool:
+    return element.tag == 'div' and ' '.join(element.get('class', '').split()) == 'well well-small'
+
+
+def get_column_texts(table, column_name: str) -> List[str]:
+    """Returns texts of table cells in column under header cell with column_name, as 'pd.read_html' reads them:
+    the first row of 'th' cells is a header and cells with 'colspan' are repeated."""
+    rows = [
+        [
+            (cell.tag, cell.text_content().strip())
+            for cell in row if cell.tag in ('th', 'td')
+            for _ in range(int(cell.get('colspan', 1)))
+        ]
+        for row in table.iter('tr')
+    ]
+    if not rows or any(tag != 'th' for tag, _ in rows[0]):
+        return []
+    header = [text for _, text in rows[0]]
+    if column_name not in header:
+        return []
+    column = header.index(column_name)
+    return [row[column][1] if len(row) > column else NULL_STRING for row in rows[1:]]
+
+
+def parse_case_status(content: bytes) -> str:
+    """Parses case status from content of **Inspection Details** file."""
+    for element in read_html_content(content).iter('div'):
+        if is_case_status_element(element):
+            return element.text_content()[len('Case Status: '):]
+    return NULL_STRING
+
+
+def get_case_status(inspection_number, location: str = INSPECTION_DETAILS_FOLDER_NAME) -> str:
+    """Parses case status from **Inspection Details** page in folder or archive. Used to refresh pages with 'Open'
+    cases."""
+    return parse_case_status(get_inspection_storage(location).read(inspection_number))
+
+
+def parse_inspection_content(content: bytes) -> Inspection:
+    """Parses information from content of **Inspection Details** file in a single pass over its elements."""
+    case_status, employer_str, span4_list, violation_totals = None, None, [], []
+    for element in read_html_content(content).iter('div', 'h4', 'table'):
+        if element.tag == 'div':
+            if case_status is None and is_case_status_element(element):
+                case_status = element.text_content()
+            elif 'span4' in element.get('class', '').split():
+                span4_list.append(element.text_content())
+        elif element.tag == 'h4':
+            if employer_str is None:
+                employer_str = element.text_content()
+        elif not violation_totals and VIOLATION_SUMMARY_TITLE in element.text_content():
+            violation_totals = get_column_texts(element, 'Total')
+    violation_totals += [NULL_STRING] * (5 - len(violation_totals))
+    text_with_naics = span4_list[5]
+    naics_list = text_with_naics[text_with_naics.index('\nNAICS: ') + 8: -1].split('/')
+    split_list = span4_list[6].split('\n')
     return Inspection(
-        case_status=case_status.text[len('Case Status: '):] if case_status else NULL_STRING,
+        case_status=case_status[len('Case Status: '):] if case_status else NULL_STRING,
         employer_name=employer_str[employer_str.index(' - ') + 3:],
-        union_status=span4_list[4].text[len('Union Status: '):],
+        union_status=span4_list[4][len('Union Status: '):],
         naics_code=int(naics_list[0]),
         naics_name=naics_list[1] if len(naics_list) > 1 else NULL_STRING,
         inspection_type=split_list[0][len('Inspection Type: '):],
         scope=split_list[1][len('Scope: '):],
         advance_notice=split_list[2][len('Advanced Notice: '):],
         ownership=split_list[3][len('Ownership: '):] if not split_list[3].endswith('\xa0') else NULL_STRING,
-        safety_or_health=span4_list[7].text.split('\n')[1][len('Safety/Health: '):],
+        safety_or_health=span4_list[7].split('\n')[1][len('Safety/Health: '):],
         total_initial_violations=(
-            int(violation_summary_table['Total'][0])
-            if len(violation_summary_table) and pd.notna(violation_summary_table['Total'][0])
-            else NULL_INT
+            int(violation_totals[0].replace(',', '')) if violation_totals[0] else NULL_INT
         ),
         total_current_violations=(
-            int(violation_summary_table['Total'][1])
-            if len(violation_summary_table) and pd.notna(violation_summary_table['Total'][1])
-            else NULL_INT
-        ),
-        total_initial_penalty=(
-            violation_summary_table['Total'][2]
-            if len(violation_summary_table) and pd.notna(violation_summary_table['Total'][2])
-            else NULL_STRING
-        ),
-        total_current_penalty=(
-            violation_summary_table['Total'][3]
-            if len(violation_summary_table) and pd.notna(violation_summary_table['Total'][3])
-            else NULL_STRING
-        ),
-        total_fta_penalty=(
-            violation_summary_table['Total'][4]
-            if len(violation_summary_table) and pd.notna(violation_summary_table['Total'][4])
-            else NULL_STRING
+            int(violation_totals[1].replace(',', '')) if violation_totals[1] else NULL_INT
         ),
+        total_initial_penalty=violation_totals[2],
+        total_current_penalty=violation_totals[3],
+        total_fta_penalty=violation_totals[4],
     )
 
 
-def get_inspection_details_list(inspection_number):
+def parse_inspection_file(inspection_number, location: str = INSPECTION_DETAILS_FOLDER_NAME) -> Inspection:
+    """Parses information from **Inspection Details** page in folder or archive and returns it as instance of
+     Inspection dataclass.\n
+    File example: https://www.osha.gov/ords/imis/establishment.inspection_detail?id=1595777.015 \n
+    Definitions: https://www.osha.gov/data/inspection-detail-definitions#tab1
+    """
+    return parse_inspection_content(get_inspection_storage(location).read(inspection_number))
+
+
+def get_parser_errors(location: str = INSPECTION_DETAILS_FOLDER_NAME) -> Dict[str, Inspection]:
+    """Parses pages of inspections from DATASETS_DICT and returns parsed instances which differ from expected."""
+    storage = get_inspection_storage(location)
+    errors = {}
+    for inspections in DATASETS_DICT.values():
+        for inspection_number, expected_inspection in inspections.items():
+            inspection = parse_inspection_content(storage.read(inspection_number))
+            if inspection != expected_inspection:
+                errors[inspection_number] = inspection
+    return errors
+
+
+def get_inspection_details_list(inspection_number, location: str = INSPECTION_DETAILS_FOLDER_NAME):
     """Used to add new columns using apply function:
     new_columns_names = list(Inspection.__annotations__.keys())
     df[new_columns_names] = df.apply(lambda row: get_inspection_details_list(str(row['Inspection Number'])),
     axis='columns', result_type='expand')
+    For many inspections 'parse_inspection_files' is much faster.
+    Files are parsed only if they changed since they were saved to 'ParsedInspectionStore'.
     """
+    # Imported here, because 'inspection_index' module depends on this one
+    from inspection_index import get_parsed_inspection_store
     # if os.path.exists(inspection_number):
-    ins = parse_inspection_file(f'{INSPECTION_DETAILS_FOLDER_NAME}/{inspection_number}.html')
+    ins = get_parsed_inspection_store(location).get(inspection_number)
     return [ins.__getattribute__(field.name) for field in fields(ins)]
     # else:
     # except FileNotFoundError:
     #     return ['No file'] * len(fields(Inspection))
+
+
+def _parse_inspection_number(inspection_number: str, location: str) -> Tuple[str, Optional[tuple], Optional[str]]:
+    """Returns inspection number, values of Inspection fields and error message if page can't be parsed."""
+    try:
+        content = get_inspection_storage(location).read(inspection_number)
+        return inspection_number, astuple(parse_inspection_content(content)), None
+    except Exception as error:  # Every broken file is reported instead of stopping the batch
+        return inspection_number, None, f'{type(error).__name__}: {error}'
+
+
+def inspections_to_frame(results: List[Tuple[str, Optional[tuple], Optional[str]]]) -> pd.DataFrame:
+    """Returns dataframe with 'inspection_number', Inspection fields with INSPECTION_DTYPES and 'error' columns.
+    NULL_INT and NULL_STRING values, as well as fields of files with errors, are converted to missing values."""
+    field_names = [field.name for field in fields(Inspection)]
+    df = pd.DataFrame.from_records(
+        [values if values is not None else (None,) * len(field_names) for _, values, _ in results],
+        columns=field_names,
+    )
+    for name, dtype in INSPECTION_DTYPES.items():
+        df[name] = df[name].mask(df[name] == (NULL_INT if dtype == 'Int64' else NULL_STRING))
+    df = df.astype(INSPECTION_DTYPES)
+    df.insert(0, 'inspection_number', pd.array([number for number, _, _ in results], dtype='string'))
+    df['error'] = pd.array([error for _, _, error in results], dtype='string')
+    return df
+
+
+def parse_inspection_results(
+        inspection_numbers: Iterable[str],
+        location: str = INSPECTION_DETAILS_FOLDER_NAME,
+        processes: Optional[int] = None,
+        chunksize: int = 64,
+) -> List[Tuple[str, Optional[tuple], Optional[str]]]:
+    """Parses pages of inspection_numbers from folder or archive in pool of processes. Returns inspection number,
+    values of Inspection fields (None if page can't be parsed) and error message (None if page is parsed)."""
+    with ProcessPoolExecutor(processes) as executor:
+        return list(executor.map(
+            partial(_parse_inspection_number, location=location), inspection_numbers, chunksize=chunksize
+        ))
+
+
+def parse_inspection_files(
+        inspection_numbers: Optional[Iterable[str]] = None,
+        location: str = INSPECTION_DETAILS_FOLDER_NAME,
+        processes: Optional[int] = None,
+        chunksize: int = 64,
+) -> pd.DataFrame:
+    """Parses pages of inspection_numbers (all pages in folder or archive by default) in pool of processes and
+    returns them as dataframe (see 'inspections_to_frame'). Pages that can't be parsed have their error in 'error' column.
+    Example: df.merge(parse_inspection_files(df['Inspection Number'].astype(str)), how='left',
+    left_on=df['Inspection Number'].astype(str), right_on='inspection_number')
+    """
+    if inspection_numbers is None:
+        inspection_numbers = get_inspection_storage(location).get_inspection_numbers()
+    return inspections_to_frame(parse_inspection_results(inspection_numbers, location, processes, chunksize))
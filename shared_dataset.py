@@ -0,0 +1,230 @@
+"""Module for dataset shared by all processes of app (e.g. gunicorn workers). Cleaned data and arrays of its
+'FilterIndex' are written once per version of partitions to a snapshot folder next to them: data as Arrow IPC file
+and index as NumPy files. Every process memory-maps them read-only and builds dataframe on top of mapped buffers
+without copying, so pages of data are kept in memory once for all workers.
+Run this module to compare memory of workers with and without snapshot (see 'benchmark_worker_memory')."""
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from constants import CACHE_FOLDER_NAME
+from filter_engine import FilterIndex
+from ita_data import cache_lock, get_data_version, read_ita_partitions
+
+SNAPSHOT_FOLDER_PREFIX = "snapshot_v"
+SNAPSHOT_DATA_FILE_NAME = "data.arrow"
+SNAPSHOT_INFO_FILE_NAME = "snapshot.json"
+INDEX_FOLDER_NAME = "index"
+MASK_SUFFIX = "__mask"  # Column with missing values mask of nullable column
+SNAPSHOT_METADATA_KEY = b"moby_columns"
+# Increment when layout of snapshot or filter index changes, so that snapshots of older format are rewritten
+SNAPSHOT_FORMAT_VERSION = 2
+BENCHMARK_WORKER_COUNTS = (1, 2, 4, 8)
+
+
+def get_snapshot_folder(version: int, cache_folder: str = CACHE_FOLDER_NAME) -> str:
+    return os.path.join(cache_folder, f"{SNAPSHOT_FOLDER_PREFIX}{version}")
+
+
+def frame_to_table(df: pd.DataFrame) -> pa.Table:
+    """Returns table with one chunk per column whose buffers can be used by pandas without copying: nullable
+    numbers are stored as values and uint8 mask column, categoricals as codes. Kinds of columns and categories
+    are saved in schema metadata."""
+    arrays, names, columns = [], [], {}
+    for name, column in df.items():
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            categories = column.cat.categories
+            columns[name] = {"kind": "category", "categories": categories.tolist(), "dtype": str(categories.dtype)}
+            arrays.append(pa.array(column.cat.codes.to_numpy()))
+            names.append(name)
+        elif pd.api.types.is_string_dtype(column.dtype):
+            # Strings are read back as Arrow strings
+            columns[name] = {"kind": "string"}
+            arrays.append(pa.chunked_array(pa.array(column.array, type=pa.large_string())).combine_chunks())
+            names.append(name)
+        elif isinstance(column.dtype, pd.api.extensions.ExtensionDtype):
+            # Nullable numbers and booleans, missing values are 0 under the mask. Booleans are stored as uint8,
+            # because Arrow packs them to bits
+            columns[name] = {"kind": "masked", "dtype": str(column.dtype)}
+            values = column.to_numpy(dtype=column.dtype.numpy_dtype, na_value=0)
+            values = values.view(np.uint8) if values.dtype == bool else values
+            arrays += [pa.array(values), pa.array(column.isna().to_numpy().view(np.uint8))]
+            names += [name, name + MASK_SUFFIX]
+        else:
+            columns[name] = {"kind": "numpy", "dtype": str(column.dtype)}
+            arrays.append(pa.array(column.to_numpy()))
+            names.append(name)
+    table = pa.Table.from_arrays(arrays, names=names)
+    return table.replace_schema_metadata({SNAPSHOT_METADATA_KEY: json.dumps(columns)})
+
+
+def _to_numpy(column: pa.ChunkedArray, dtype) -> np.ndarray:
+    """Returns view of the only chunk of column without nulls as read-only array."""
+    chunk = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    return np.frombuffer(chunk.buffers()[1], dtype=dtype)[chunk.offset: chunk.offset + len(chunk)]
+
+
+def table_to_frame(table: pa.Table) -> pd.DataFrame:
+    """Returns dataframe of table written by 'frame_to_table'. Columns are views of buffers of table, e.g. of
+    memory-mapped file, so they are read-only."""
+    columns = json.loads(table.schema.metadata[SNAPSHOT_METADATA_KEY])
+    data = {}
+    for name, column in columns.items():
+        arrow_column = table.column(name)
+        if column["kind"] == "category":
+            dtype = pd.CategoricalDtype(pd.Index(column["categories"], dtype=column["dtype"]))
+            codes = _to_numpy(arrow_column, arrow_column.type.to_pandas_dtype())
+            data[name] = pd.Categorical.from_codes(codes, dtype=dtype)
+        elif column["kind"] == "string":
+            data[name] = pd.arrays.ArrowStringArray(arrow_column)
+        elif column["kind"] == "masked":
+            dtype = pd.api.types.pandas_dtype(column["dtype"])
+            values = _to_numpy(arrow_column, arrow_column.type.to_pandas_dtype()).view(dtype.numpy_dtype)
+            mask = _to_numpy(table.column(name + MASK_SUFFIX), np.uint8).view(bool)
+            data[name] = dtype.construct_array_type()(values, mask, copy=False)
+        else:
+            data[name] = _to_numpy(arrow_column, column["dtype"])
+    return pd.DataFrame(data, copy=False)
+
+
+def _get_snapshot_version(folder: str) -> Optional[int]:
+    """Returns version of snapshot folder, None for other folders (e.g. temporary ones)."""
+    suffix = os.path.basename(folder)[len(SNAPSHOT_FOLDER_PREFIX):]
+    return int(suffix) if suffix.isdigit() else None
+
+
+def _is_current_snapshot(snapshot_folder: str) -> bool:
+    """Returns whether snapshot folder exists and is written in the current format."""
+    try:
+        with open(os.path.join(snapshot_folder, SNAPSHOT_INFO_FILE_NAME), "r", encoding="utf-8") as file:
+            return json.load(file).get("format") == SNAPSHOT_FORMAT_VERSION
+    except FileNotFoundError:
+        return False
+
+
+def write_snapshot(cache_folder: str = CACHE_FOLDER_NAME) -> str:
+    """Writes snapshot of the current version of partitions unless it exists, removes snapshots of older versions
+    and returns folder of snapshot. Runs under 'cache_lock' like ingestion, so the snapshot is written once while
+    other workers wait for it, and partitions don't change meanwhile. Snapshot is written to temporary folder which
+    is renamed at once, so processes reading without the lock never see half-written snapshot."""
+    with cache_lock(cache_folder):
+        version = get_data_version(cache_folder)
+        snapshot_folder = get_snapshot_folder(version, cache_folder)
+        for folder in glob.glob(os.path.join(cache_folder, f"{SNAPSHOT_FOLDER_PREFIX}*")):
+            folder_version = _get_snapshot_version(folder)
+            # Temporary folders are left only by interrupted writes, since they are written under the lock.
+            # Memory-mapped files of removed snapshots stay readable by processes which still use them.
+            if folder_version is None or folder_version < version:
+                shutil.rmtree(folder, ignore_errors=True)
+        if not _is_current_snapshot(snapshot_folder):
+            shutil.rmtree(snapshot_folder, ignore_errors=True)
+            # Workers which waited for the lock find the snapshot and don't read partitions
+            _write_snapshot_folder(*read_ita_partitions(cache_folder), snapshot_folder)
+    return snapshot_folder
+
+
+def _write_snapshot_folder(version: int, df: pd.DataFrame, snapshot_folder: str) -> None:
+    temporary_folder = f"{snapshot_folder}.{os.getpid()}.tmp"
+    os.makedirs(os.path.join(temporary_folder, INDEX_FOLDER_NAME), exist_ok=True)
+    table = frame_to_table(df)
+    with pa.OSFile(os.path.join(temporary_folder, SNAPSHOT_DATA_FILE_NAME), "wb") as file:
+        with pa.ipc.new_file(file, table.schema) as writer:
+            writer.write_table(table)
+    arrays, bitset_values = FilterIndex(df).to_arrays()
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary_folder, INDEX_FOLDER_NAME, f"{name}.npy"), array)
+    with open(os.path.join(temporary_folder, SNAPSHOT_INFO_FILE_NAME), "w", encoding="utf-8") as file:
+        json.dump({"format": SNAPSHOT_FORMAT_VERSION, "version": version, "rows": len(df), "bitset_values": bitset_values}, file)
+    os.rename(temporary_folder, snapshot_folder)
+
+
+def read_snapshot(cache_folder: str = CACHE_FOLDER_NAME) -> Tuple[int, pd.DataFrame, FilterIndex]:
+    """Returns version, dataframe and filter index of the current version of partitions from memory-mapped snapshot.
+    Snapshot is written first if it doesn't exist or is written in older format."""
+    snapshot_folder = get_snapshot_folder(get_data_version(cache_folder), cache_folder)
+    if not _is_current_snapshot(snapshot_folder):
+        snapshot_folder = write_snapshot(cache_folder)
+    with open(os.path.join(snapshot_folder, SNAPSHOT_INFO_FILE_NAME), "r", encoding="utf-8") as file:
+        info = json.load(file)
+    # Buffers of table keep memory map open
+    table = pa.ipc.open_file(pa.memory_map(os.path.join(snapshot_folder, SNAPSHOT_DATA_FILE_NAME))).read_all()
+    df = table_to_frame(table)
+    arrays = {
+        os.path.basename(path)[:-len(".npy")]: np.load(path, mmap_mode="r")
+        for path in glob.glob(os.path.join(snapshot_folder, INDEX_FOLDER_NAME, "*.npy"))
+    }
+    return info["version"], df, FilterIndex.from_arrays(df, arrays, info["bitset_values"])
+
+
+def get_memory_usage_of_process() -> Dict[str, int]:
+    """Returns RSS, PSS (shared pages are divided by number of processes which use them) and private memory of
+    current process in bytes. Linux only."""
+    values = {}
+    with open("/proc/self/smaps_rollup", "r", encoding="utf-8") as file:
+        for line in file:
+            key, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                values[key] = int(value.split()[0]) * 1024
+    return {"rss": values["Rss"], "pss": values["Pss"],
+            "private": values["Private_Clean"] + values["Private_Dirty"]}
+
+
+def _run_benchmark_worker(shared: bool, cache_folder: str, loaded: Any, measured: Any, results: Any) -> None:
+    """Loads dataset like app worker, serves a few typical requests and reports its memory when all workers
+    have loaded, so that PSS is divided by all of them."""
+    from ita_dataset import build_ita_dataset
+
+    dataset = build_ita_dataset(cache_folder, shared=shared)
+    # Whole data is read, like by requests without filters
+    dataset.data.take(dataset.index.filter_positions()).to_dict("records")
+    dataset.index.filter_positions(states=dataset.data["state"].cat.categories[:1].tolist())
+    loaded.wait()
+    results.put(get_memory_usage_of_process())
+    measured.wait()
+
+
+def benchmark_worker_memory(
+    worker_counts: Iterable[int] = BENCHMARK_WORKER_COUNTS,
+    cache_folder: str = CACHE_FOLDER_NAME,
+) -> pd.DataFrame:
+    """Starts every number of worker processes with dataset loaded from partitions (every worker has its own copy)
+    and from shared snapshot, and returns mean RSS, PSS and private memory per worker (MiB) and total PSS of
+    workers. RSS counts shared pages in every process that uses them, so total PSS shows memory which is used."""
+    write_snapshot(cache_folder)
+    context = multiprocessing.get_context("spawn")  # Workers import everything like separate gunicorn workers
+    rows: List[Dict[str, Any]] = []
+    for shared in [False, True]:
+        for worker_count in worker_counts:
+            loaded, measured = context.Barrier(worker_count + 1), context.Barrier(worker_count + 1)
+            results = context.Queue()
+            workers = [
+                context.Process(target=_run_benchmark_worker, args=(shared, cache_folder, loaded, measured, results))
+                for _ in range(worker_count)
+            ]
+            for worker in workers:
+                worker.start()
+            loaded.wait()
+            usages = pd.DataFrame([results.get() for _ in workers]) / 2 ** 20
+            measured.wait()
+            for worker in workers:
+                worker.join()
+            rows.append({
+                "mode": "shared" if shared else "copy",
+                "workers": worker_count,
+                "rss_per_worker": usages["rss"].mean(),
+                "pss_per_worker": usages["pss"].mean(),
+                "private_per_worker": usages["private"].mean(),
+                "total_pss": usages["pss"].sum(),
+            })
+    return pd.DataFrame(rows).round(1)
+
+
+if __name__ == "__main__":
+    print(benchmark_worker_memory().to_string(index=False))
@@ -0,0 +1,124 @@
+"""Module for server-side paging, sorting and filtering of Dash DataTable ('page_action', 'sort_action' and
+'filter_action' set to 'custom'). Queries are applied to row positions, and only the visible page is serialized."""
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+TABLE_PAGE_SIZE = 50
+FILTER_OPERATORS = [
+    ["ge ", ">="],
+    ["le ", "<="],
+    ["lt ", "<"],
+    ["gt ", ">"],
+    ["ne ", "!="],
+    ["eq ", "="],
+    ["contains "],
+    ["datestartswith "],
+]
+# Operands of these operators are matched as text, e.g. 'contains 23' searches for '23' and not '23.0'
+TEXT_OPERATORS = ["contains", "datestartswith"]
+
+
+def split_filter_part(filter_part: str) -> Tuple[Optional[str], Optional[str], Any]:
+    """Splits one part of DataTable 'filter_query', e.g. '{state} eq "CA"', to column name, operator and value."""
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator not in filter_part:
+                continue
+            name_part, value_part = filter_part.split(operator, 1)
+            name = name_part[name_part.find("{") + 1: name_part.rfind("}")]
+            value_part = value_part.strip()
+            if value_part and value_part[0] == value_part[-1] and value_part[0] in ("'", '"', "`"):
+                value = value_part[1:-1].replace("\\" + value_part[0], value_part[0])
+            elif operator_type[0].strip() in TEXT_OPERATORS:
+                value = value_part
+            else:
+                try:
+                    value = float(value_part)
+                except ValueError:
+                    value = value_part
+            # Word operators need spaces after them in the filter string, but we don't want these later
+            return name, operator_type[0].strip(), value
+    return None, None, None
+
+
+def _coerce_value(column: pd.Series, value: Any) -> Any:
+    """Returns filter value of the column type where possible: numbers typed as text for numeric columns, and text
+    of numbers for text columns, e.g. 2020 for '2020' without '.0'."""
+    if pd.api.types.is_numeric_dtype(column.dtype) and isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    if not pd.api.types.is_numeric_dtype(column.dtype) and isinstance(value, float):
+        return str(int(value)) if value.is_integer() else str(value)
+    return value
+
+
+def get_filter_mask(column: pd.Series, operator: str, value: Any) -> np.ndarray:
+    """Returns boolean mask of column values matching filter. Categoricals are filtered by their categories, so
+    comparisons work for unordered categoricals too. Text isn't ordered with numbers, so such comparisons match
+    nothing ('ne' matches everything)."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Code -1 of missing values takes the last item, which doesn't match
+        matches = np.append(get_filter_mask(pd.Series(column.cat.categories), operator, value), False)
+        return matches[column.cat.codes.to_numpy()]
+    if operator in ("eq", "ne", "lt", "le", "gt", "ge"):
+        value = _coerce_value(column, value)
+        if pd.api.types.is_numeric_dtype(column.dtype) and isinstance(value, str):
+            return np.full(len(column), operator == "ne")
+        mask = getattr(column, operator)(value)
+    elif operator == "contains":
+        mask = column.astype(str).str.contains(str(value), regex=False)
+    else:  # datestartswith
+        mask = column.astype(str).str.startswith(str(value))
+    return mask.to_numpy(dtype=bool, na_value=False)
+
+
+def query_positions(
+    df: pd.DataFrame,
+    positions: np.ndarray,
+    sort_by: Optional[List[Dict[str, str]]] = None,
+    filter_query: Optional[str] = None,
+) -> np.ndarray:
+    """Applies DataTable 'filter_query' and 'sort_by' to rows of dataframe at positions.
+    Only columns referenced in query are read."""
+    for filter_part in (filter_query or "").split(" && "):
+        column_name, operator, value = split_filter_part(filter_part)
+        if column_name not in df.columns:
+            continue
+        column = df[column_name].iloc[positions].reset_index(drop=True)
+        positions = positions[get_filter_mask(column, operator, value)]
+    sort_by = [sorting for sorting in sort_by or [] if sorting["column_id"] in df.columns]
+    if sort_by and len(positions):
+        sort_frame = pd.DataFrame(
+            {i: df[sorting["column_id"]].iloc[positions].to_numpy() for i, sorting in enumerate(sort_by)}
+        )
+        order = sort_frame.sort_values(
+            by=list(sort_frame.columns),
+            ascending=[sorting["direction"] == "asc" for sorting in sort_by],
+            kind="mergesort",
+            na_position="last",
+        ).index.to_numpy()
+        positions = positions[order]
+    return positions
+
+
+def get_table_page(
+    df: pd.DataFrame,
+    positions: np.ndarray,
+    page_current: Optional[int],
+    page_size: Optional[int],
+    sort_by: Optional[List[Dict[str, str]]] = None,
+    filter_query: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """Returns records of the requested page and number of pages for rows of dataframe at positions.
+    Page number is limited to the last page, so that page doesn't become empty when filters are narrowed."""
+    positions = query_positions(df, positions, sort_by, filter_query)
+    page_size = page_size or TABLE_PAGE_SIZE
+    page_count = max(math.ceil(len(positions) / page_size), 1)
+    page_current = min(page_current or 0, page_count - 1)
+    page_positions = positions[page_current * page_size: (page_current + 1) * page_size]
+    return df.take(page_positions).to_dict("records"), page_count
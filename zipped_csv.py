@@ -0,0 +1,136 @@
+"""Module for streaming CSV files in zip archives in chunks, so that memory usage is bounded by chunk size instead of
+size of archive (e.g. OSHA enforcement data: https://enforcedata.dol.gov/views/data_summary.php)."""
+import queue
+import threading
+from typing import Callable, Iterator, List, Optional
+from zipfile import ZipFile
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import parquet
+
+CSV_CHUNK_SIZE = 100_000
+
+RowFilter = Callable[[pd.DataFrame], pd.Series]
+
+
+def get_csv_member_names(path: str) -> List[str]:
+    """Returns names of CSV files in archive."""
+    with ZipFile(path, mode="r") as zip_file:
+        return [info.filename for info in zip_file.infolist() if info.filename.endswith(".csv")]
+
+
+def iter_member_chunks(
+        path: str,
+        member_name: str,
+        chunksize: int = CSV_CHUNK_SIZE,
+        row_filter: Optional[RowFilter] = None,
+        **kwargs,
+) -> Iterator[pd.DataFrame]:
+    """Yields chunks of one CSV file in archive. 'row_filter' returns mask of rows to keep in chunk,
+    'kwargs' are passed to 'pd.read_csv' (e.g. 'usecols' and 'dtype')."""
+    with ZipFile(path, mode="r") as zip_file, zip_file.open(member_name) as file:
+        for chunk in pd.read_csv(file, chunksize=chunksize, **kwargs):
+            if row_filter is not None:
+                chunk = chunk[row_filter(chunk).to_numpy(dtype=bool)]
+            yield chunk
+
+
+def _put(chunks: "queue.Queue", item, stop: threading.Event) -> bool:
+    """Puts item to queue unless consumer stopped. Returns False if it did."""
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read_members_to_queue(path: str, member_names: "queue.Queue", chunks: "queue.Queue", stop: threading.Event,
+                           read_kwargs: dict) -> None:
+    """Reads members taken from 'member_names' and puts their chunks to 'chunks', then puts None.
+    Errors are put to 'chunks' to be raised by consumer."""
+    try:
+        while not stop.is_set():
+            try:
+                member_name = member_names.get_nowait()
+            except queue.Empty:
+                break
+            for chunk in iter_member_chunks(path, member_name, **read_kwargs):
+                if not _put(chunks, chunk, stop):
+                    return
+    except Exception as error:  # Raised in consumer thread
+        _put(chunks, error, stop)
+        return
+    _put(chunks, None, stop)
+
+
+def iter_zipped_csv_chunks(
+        path: str,
+        chunksize: int = CSV_CHUNK_SIZE,
+        row_filter: Optional[RowFilter] = None,
+        max_workers: int = 1,
+        **kwargs,
+) -> Iterator[pd.DataFrame]:
+    """Yields chunks of all CSV files in archive (see 'iter_member_chunks' for arguments). If 'max_workers' > 1,
+    files are read in parallel threads and chunks are yielded in order of reading. At most 2 * 'max_workers'
+    chunks wait in memory."""
+    member_names = get_csv_member_names(path)
+    read_kwargs = dict(kwargs, chunksize=chunksize, row_filter=row_filter)
+    if max_workers <= 1 or len(member_names) <= 1:
+        for member_name in member_names:
+            yield from iter_member_chunks(path, member_name, **read_kwargs)
+        return
+
+    names_queue = queue.Queue()
+    for member_name in member_names:
+        names_queue.put(member_name)
+    chunks = queue.Queue(maxsize=2 * max_workers)
+    stop = threading.Event()
+    workers = [
+        threading.Thread(target=_read_members_to_queue, args=(path, names_queue, chunks, stop, read_kwargs),
+                         daemon=True)
+        for _ in range(min(max_workers, len(member_names)))
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        running_workers = len(workers)
+        while running_workers:
+            chunk = chunks.get()
+            if chunk is None:
+                running_workers -= 1
+            elif isinstance(chunk, Exception):
+                raise chunk
+            else:
+                yield chunk
+    finally:
+        # Workers waiting on full queue stop when consumer stops early
+        stop.set()
+
+
+def write_zipped_csv_to_parquet(
+        path: str,
+        output_path: str,
+        chunksize: int = CSV_CHUNK_SIZE,
+        row_filter: Optional[RowFilter] = None,
+        max_workers: int = 1,
+        **kwargs,
+) -> int:
+    """Writes all CSV files in archive to Parquet file, every chunk is a row group. Schema is taken from the first
+    chunk, so 'dtype' should be passed for columns whose type can differ between chunks (e.g. empty in some).
+    Returns number of written rows, file isn't written if archive has no CSV files."""
+    row_count = 0
+    writer = None
+    try:
+        for chunk in iter_zipped_csv_chunks(path, chunksize, row_filter, max_workers, **kwargs):
+            if writer is None:
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                writer = parquet.ParquetWriter(output_path, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            row_count += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return row_count